@@ -0,0 +1,110 @@
+"""Download a corpus of recorded Diario Oficial extracts for the benchmarks.
+
+Takes the first `--per-section` PDFs of each section of "Empresas y
+Cooperativas" on a fixed set of publication dates, so every run downloads
+the same documents, and writes them with a manifest of their links and
+sha256 to check a corpus against:
+
+    python benchmarks/fetch_corpus.py benchmarks/corpus
+    python benchmarks/fetch_corpus.py benchmarks/corpus --check
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.base_scraper import get_session  # noqa: E402
+from scraper.diario_oficial_scraper import (  # noqa: E402
+    DiarioOficialScraper,
+    fetch_url,
+    parse_edition_records,
+)
+
+# Spread over the years the layout of the extracts changed, Monday to Saturday
+DATES = ("02-01-2018", "04-06-2019", "02-09-2020", "07-04-2022", "05-07-2023")
+SECTIONS = ("CONSTITUCIÓN", "MODIFICACIÓN", "DISOLUCIÓN")
+MANIFEST = "manifest.json"
+DELAY = 1.0  # seconds between downloads, be nice to the government
+
+
+def iter_documents(dates, per_section):
+    for date in dates:
+        for edition in DiarioOficialScraper(date).fetch_editions():
+            url = (
+                "https://www.diariooficial.interior.gob.cl/edicionelectronica/"
+                f"empresas_cooperativas.php?{edition.split('?')[1]}"
+            )
+            taken = dict.fromkeys(SECTIONS, 0)
+            for record in parse_edition_records(fetch_url(url)):
+                section = record["section"]
+                if section in taken and taken[section] < per_section:
+                    taken[section] += 1
+                    yield date, section, record["link"]
+
+
+def fetch(path, dates, per_section):
+    os.makedirs(path, exist_ok=True)
+    manifest = []
+    for index, (date, section, link) in enumerate(iter_documents(dates, per_section)):
+        response = get_session().get(link, timeout=60)
+        response.raise_for_status()
+        name = f"{index:03d}.pdf"
+        with open(os.path.join(path, name), "wb") as file:
+            file.write(response.content)
+        manifest.append(
+            {
+                "file": name,
+                "date": date,
+                "section": section,
+                "link": link,
+                "sha256": hashlib.sha256(response.content).hexdigest(),
+            }
+        )
+        print(f"{name} {date} {section} {link}")
+        time.sleep(DELAY)
+    with open(os.path.join(path, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def check(path):
+    """Names of the documents of the manifest missing or changed in `path`."""
+    with open(os.path.join(path, MANIFEST), encoding="utf-8") as file:
+        manifest = json.load(file)
+    changed = []
+    for document in manifest:
+        try:
+            with open(os.path.join(path, document["file"]), "rb") as file:
+                digest = hashlib.sha256(file.read()).hexdigest()
+        except FileNotFoundError:
+            digest = None
+        if digest != document["sha256"]:
+            changed.append(document["file"])
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="directory to write the PDFs to")
+    parser.add_argument("--dates", nargs="+", default=list(DATES))
+    parser.add_argument("--per-section", type=int, default=2)
+    parser.add_argument(
+        "--check", action="store_true", help="verify the corpus against its manifest"
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        changed = check(args.path)
+        for name in changed:
+            print(f"missing or changed: {name}")
+        sys.exit(1 if changed else 0)
+    manifest = fetch(args.path, args.dates, args.per_section)
+    print(f"{len(manifest)} documents written to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
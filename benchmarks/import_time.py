@@ -0,0 +1,76 @@
+"""Import time budget for main.py.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter (what a
+spawned pool worker pays) and `main.py --help`, and exits with an error when
+the import takes longer than the budget.
+
+    python benchmarks/import_time.py --budget-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be imported by `import main`
+HEAVY_MODULES = ("sqlalchemy", "PyPDF2", "bs4", "boto3", "openai", "tiktoken")
+
+
+def import_times(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # lines look like: "import time:  self [us] | cumulative | imported package"
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def help_seconds():
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "main.py", "--help"],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=150)
+    parser.add_argument("--module", default="main")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total_ms = times[args.module] / 1000
+    heavy = [name for name in times if name in HEAVY_MODULES]
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[1:11]
+
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms} ms)")
+    for name, cumulative in slowest:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    print(f"main.py --help: {help_seconds() * 1000:.1f} ms")
+
+    failed = False
+    if heavy:
+        print(f"Heavy modules imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Import time over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Compare the PDF text backends on a corpus of Diario Oficial extracts.
+
+For every backend reports pages/sec, peak resident memory while extracting
+and the token count of the whitespace-normalized output (what clean_text
+sends to the model). Each backend runs in its own interpreter so the peak
+RSS includes the native allocations of the libraries (pdfium, and the C
+parts of the others) and one backend doesn't inflate the next one's peak.
+The corpus is a directory of recorded PDFs, see fetch_corpus.py:
+
+    python benchmarks/fetch_corpus.py benchmarks/corpus
+    python benchmarks/pdf_backends.py benchmarks/corpus --backends pypdf2 pypdfium2
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parser.pdf_backends import BACKENDS, get_backend  # noqa: E402
+from utils.helpers import count_tokens  # noqa: E402
+
+
+def load_corpus(path):
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(".pdf"):
+            with open(os.path.join(path, name), "rb") as file:
+                corpus.append((name, file.read()))
+    return corpus
+
+
+def max_rss_mb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def run(backend, corpus):
+    pages = tokens = 0
+    failures = []
+    elapsed = 0.0
+    # warm up, the libraries are imported on first use
+    try:
+        backend.extract_pages(corpus[0][1])
+    except ImportError:
+        raise
+    except Exception:
+        pass  # the document is recorded as a failure below
+    baseline_mb = max_rss_mb()
+    for name, data in corpus:
+        start = time.perf_counter()
+        try:
+            texts = backend.extract_pages(data)
+        except Exception as e:
+            failures.append(f"{name}: {e}")
+            continue
+        finally:
+            elapsed += time.perf_counter() - start
+        pages += len(texts)
+        tokens += count_tokens(re.sub(r"\s+", " ", "".join(texts)).strip())
+    return {
+        "backend": backend.name,
+        "documents": len(corpus),
+        "pages": pages,
+        "pages_per_sec": pages / elapsed if elapsed else 0.0,
+        "peak_rss_mb": max_rss_mb(),
+        # growth over the interpreter and the imported library
+        "extraction_rss_mb": max_rss_mb() - baseline_mb,
+        "tokens": tokens,
+        "failures": failures,
+    }
+
+
+def run_isolated(name, corpus_path):
+    """Run the benchmark of one backend in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), corpus_path, "--worker", name],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"backend": name, "error": result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="directory with the recorded PDFs")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        sys.exit(f"No PDFs found in {args.corpus}")
+    if args.worker:
+        print(json.dumps(run(get_backend(args.worker), corpus)))
+        return
+
+    results = [run_isolated(name, args.corpus) for name in args.backends]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(corpus)} documents")
+    print(
+        f"{'backend':<12}{'pages':>8}{'pages/s':>10}{'peak RSS':>10}"
+        f"{'extr. RSS':>11}{'tokens':>10}"
+    )
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<12}failed to run ({result['error']})")
+            continue
+        print(
+            f"{result['backend']:<12}{result['pages']:>8}"
+            f"{result['pages_per_sec']:>10.1f}{result['peak_rss_mb']:>10.1f}"
+            f"{result['extraction_rss_mb']:>11.1f}{result['tokens']:>10}"
+        )
+        for failure in result["failures"]:
+            print(f"  failed {failure}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 import json
-from sqlalchemy import create_engine, MetaData, Column, Integer, ForeignKey, String
+from sqlalchemy import create_engine, Column, Integer, ForeignKey, String
+from sqlalchemy import DateTime, Index, LargeBinary, Text, UniqueConstraint, func
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
 from urllib.parse import quote
 from urllib.parse import quote_plus
 from sqlalchemy import URL
+from functools import lru_cache
 
 
 
 
+@lru_cache(maxsize=None)
 def get_connection(user, password, host):
+    # one engine (and connection pool) per process, the tables are mapped
+    # below so there is no need to reflect the whole schema
     url_object = URL.create(
     "postgresql",
     username=user,
@@ -21,11 +27,17 @@ def get_connection(user, password, host):
     #DATABASE_URL = f"postgresql://{user}:%s@{host}/postgres?sslmode=require" % quote_plus(password)  # azure
     #print(DATABASE_URL)
     engine = create_engine(url_object)
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
     return engine
 
 
+def create_tables(engine):
+    # only creates the tables that do not exist yet
+    Base.metadata.create_all(engine)
+    # create_all skips the indexes of tables that already exist
+    for index in CompanyRecord.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+
 # Table class definition
 class Base(DeclarativeBase):
     pass
@@ -33,7 +45,52 @@ class Base(DeclarativeBase):
 
 class CompanyRecord(Base):
     __tablename__ = "dof_2"
+    # (link, publication_date) identifies a record, not unique because older
+    # runs uploaded some records twice
+    __table_args__ = (
+        Index(
+            "dof_2_link_publication_date",
+            text("(json_payload->>'link')"),
+            text("(json_payload->>'publication_date')"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     json_payload: Mapped[dict] = mapped_column(JSON)
     batch_id: str = Column(String)
+
+
+class TextBlob(Base):
+    __tablename__ = "dof_texts"
+
+    # sha256 of the PDF text, referenced by json_payload["text_hash"]
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    codec: Mapped[str] = mapped_column(String)  # "zstd" or "zlib"
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+    length: Mapped[int] = mapped_column(Integer)
+
+
+class BackfillTask(Base):
+    __tablename__ = "dof_tasks"
+    __table_args__ = (UniqueConstraint("kind", "key"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String)  # "date" or "edition"
+    key: Mapped[str] = mapped_column(String)
+    payload: Mapped[dict] = mapped_column(JSON)
+    batch_id: Mapped[str] = mapped_column(String, nullable=True)
+    status: Mapped[str] = mapped_column(String, default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    leased_by: Mapped[str] = mapped_column(String, nullable=True)
+    lease_expires_at = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    updated_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class RateLimit(Base):
+    __tablename__ = "dof_rate_limits"
+
+    site: Mapped[str] = mapped_column(String, primary_key=True)
+    next_allowed_at = mapped_column(DateTime(timezone=True), nullable=False)
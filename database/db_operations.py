@@ -1,19 +1,157 @@
-from .db_connection import CompanyRecord
+from .db_connection import CompanyRecord, TextBlob
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
 from utils.helpers import retry_on_request
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # fall back to zlib, blobs record the codec they use
+    zstandard = None
+
+
+# Derived from text_content, regenerated on read instead of stored.
+# trimmed_text_offset stays in the payload, SQL consumers (the
+# dof_materialized_2 query in README) filter on it.
+DERIVED_TEXT_FIELDS = ("clean_text_content", "trimmed_text_content")
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress_text(text):
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def decompress_text(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def _store_text(session, text):
+    text_hash = content_hash(text)
+    # the same pdf is often linked from several editions or reruns, only
+    # the key is selected so an existing blob is not downloaded
+    exists = session.scalar(
+        select(TextBlob.content_hash).where(TextBlob.content_hash == text_hash)
+    )
+    if exists is None:
+        codec, data = compress_text(text)
+        session.execute(
+            insert(TextBlob)
+            .values(content_hash=text_hash, codec=codec, data=data, length=len(text))
+            .on_conflict_do_nothing(index_elements=["content_hash"])
+        )
+    return text_hash
+
+
+def _record_exists(session, link, publication_date):
+    # serialize the uploads of the same record, a re-leased task may be
+    # uploading it from another worker
+    session.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(f"{link} {publication_date}")))
+    )
+    return session.scalar(
+        select(CompanyRecord.id)
+        .where(
+            CompanyRecord.json_payload["link"].astext == link,
+            CompanyRecord.json_payload["publication_date"].astext
+            == publication_date,
+        )
+        .limit(1)
+    )
 
 
 @retry_on_request
 def upload_to_db(engine, dict_entities, batch_id):
+    """Insert a record, skipping it if (link, publication_date) is already
+    stored. Returns whether it was inserted."""
+    # the text is stored once per content hash, the payload references it
+    payload = {
+        key: value
+        for key, value in dict_entities.items()
+        if key != "text_content" and key not in DERIVED_TEXT_FIELDS
+    }
     try:
         with Session(engine) as session:
-            record = CompanyRecord(json_payload=dict_entities, batch_id=batch_id)
+            link = dict_entities.get("link")
+            publication_date = dict_entities.get("publication_date")
+            if link and _record_exists(session, link, publication_date):
+                print(f"Record {link} of {publication_date} already uploaded")
+                return False
+            if dict_entities.get("text_content") is not None:
+                payload["text_hash"] = _store_text(
+                    session, dict_entities["text_content"]
+                )
+            record = CompanyRecord(json_payload=payload, batch_id=batch_id)
             session.add(record)
             session.commit()
+        return True
     except OperationalError:
         print(f"Failed to upload batch_id {batch_id} to the database.")
         raise
     except Exception as e:
         print(f"Unexpected error: {e}")
         raise
+
+
+def load_unextracted_records(engine, sections, batch_id=None, limit=1000):
+    """(id, json_payload) of the records of `sections` with no entities yet."""
+    query = select(CompanyRecord.id, CompanyRecord.json_payload).where(
+        CompanyRecord.json_payload["section"].astext.in_(list(sections)),
+        CompanyRecord.json_payload["entities"].astext.is_(None),
+    )
+    if batch_id is not None:
+        query = query.where(CompanyRecord.batch_id == batch_id)
+    with Session(engine) as session:
+        return session.execute(query.order_by(CompanyRecord.id).limit(limit)).all()
+
+
+@retry_on_request
+def save_extractions(engine, records):
+    """Write the entities (or extraction_error) of records loaded with
+    load_unextracted_records back to their rows, keyed by record["id"]."""
+    with Session(engine) as session:
+        for record in records:
+            row = session.get(CompanyRecord, record["id"])
+            payload = dict(row.json_payload)
+            payload.pop("extraction_error", None)
+            for key in ("entities", "extraction_error"):
+                if key in record:
+                    payload[key] = record[key]
+            row.json_payload = payload
+        session.commit()
+
+
+def load_text(engine, text_hash):
+    with Session(engine) as session:
+        blob = session.get(TextBlob, text_hash)
+        if blob is None:
+            return None
+        return decompress_text(blob.codec, blob.data)
+
+
+def hydrate_record(engine, json_payload):
+    """Return a payload with its text_content, clean_text_content and
+    trimmed_text_content, loaded from the text blob and derived from it."""
+    from utils.helpers import clean_text, trim_offset, trimmed_text
+
+    if "text_hash" not in json_payload:
+        return json_payload  # rows written before texts were deduplicated
+    record = dict(json_payload)
+    record["text_content"] = load_text(engine, record["text_hash"])
+    if record["text_content"] is not None:
+        record["clean_text_content"] = clean_text(record["text_content"])
+        if "trimmed_text_offset" not in record:
+            record["trimmed_text_offset"] = trim_offset(record["clean_text_content"])
+        # a None offset ("EXTRACTO" not found) keeps the whole clean text
+        record["trimmed_text_content"] = trimmed_text(record)
+    return record
@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import JSON, DateTime, Integer, String, Text, create_engine, event
+from sqlalchemy import select
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+from tenacity import RetryError
+import logging
+import os
+
+
+# A local SQLite file by default so failed database writes can be kept while
+# the database is down, point it to Postgres to share it between nodes
+DEFAULT_DEAD_LETTER_URL = "sqlite:///dead_letters.db"
+FIRST_RETRY_DELAY = timedelta(minutes=15)
+MAX_RETRY_DELAY = timedelta(hours=24)
+MAX_RETRIES = 8
+# Seconds a pool worker waits for another one holding the SQLite write lock
+SQLITE_BUSY_TIMEOUT = 30
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class DeadLetter(Base):
+    __tablename__ = "dof_dead_letters"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String)  # "pdf", "llm" or "db"
+    key: Mapped[str] = mapped_column(String)
+    payload: Mapped[dict] = mapped_column(JSON)
+    error_class: Mapped[str] = mapped_column(String)
+    error_message: Mapped[str] = mapped_column(Text)
+    attempts: Mapped[int] = mapped_column(Integer)
+    retries: Mapped[int] = mapped_column(Integer, default=0)
+    # pending, resolved or abandoned
+    status: Mapped[str] = mapped_column(String, default="pending", index=True)
+    next_attempt_at = mapped_column(DateTime, index=True)
+    created_at = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at = mapped_column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+
+def unwrap_error(error):
+    """Return the underlying exception and the number of attempts made."""
+    if isinstance(error, RetryError):
+        return error.last_attempt.exception(), error.last_attempt.attempt_number
+    return error, 1
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    # readers don't block the writers of the other pool workers
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+def create_dead_letter_engine(url):
+    if url.startswith("sqlite"):
+        engine = create_engine(url, connect_args={"timeout": SQLITE_BUSY_TIMEOUT})
+        event.listen(engine, "connect", _enable_wal)
+        return engine
+    return create_engine(url)
+
+
+def retry_delay(retries):
+    return min(FIRST_RETRY_DELAY * 2**retries, MAX_RETRY_DELAY)
+
+
+class DeadLetterStore:
+    """Persistent store of the units of work (PDF download, LLM call,
+    database write) that failed after their inline retries.
+
+    The table is created once with create_tables(), by the parent process
+    before the pool workers start, never concurrently by the workers.
+    """
+
+    def __init__(self, url=None, max_retries=MAX_RETRIES):
+        self.engine = create_dead_letter_engine(
+            url or os.getenv("DEAD_LETTER_DB", DEFAULT_DEAD_LETTER_URL)
+        )
+        self.max_retries = max_retries
+
+    def create_tables(self):
+        Base.metadata.create_all(self.engine)
+
+    def add(self, kind, key, payload, error):
+        """Store a failed unit of work. Returns False (and logs) when it
+        can't be stored, the caller carries on with the next document."""
+        error, attempts = unwrap_error(error)
+        try:
+            with Session(self.engine) as session:
+                session.add(
+                    DeadLetter(
+                        kind=kind,
+                        key=key,
+                        payload=payload,
+                        error_class=type(error).__name__,
+                        error_message=str(error),
+                        attempts=attempts,
+                        retries=0,
+                        status="pending",
+                        next_attempt_at=datetime.utcnow() + retry_delay(0),
+                    )
+                )
+                session.commit()
+        except Exception:
+            logging.exception(f"Failed to store the dead letter of {kind} {key}")
+            return False
+        return True
+
+    def due(self, limit=100):
+        with Session(self.engine) as session:
+            letters = session.scalars(
+                select(DeadLetter)
+                .where(
+                    DeadLetter.status == "pending",
+                    DeadLetter.next_attempt_at <= datetime.utcnow(),
+                )
+                .order_by(DeadLetter.next_attempt_at)
+                .limit(limit)
+            ).all()
+            session.expunge_all()
+            return letters
+
+    def resolve(self, letter):
+        with Session(self.engine) as session:
+            session.get(DeadLetter, letter.id).status = "resolved"
+            session.commit()
+
+    def reschedule(self, letter, error):
+        error, attempts = unwrap_error(error)
+        with Session(self.engine) as session:
+            stored = session.get(DeadLetter, letter.id)
+            stored.retries += 1
+            stored.attempts += attempts
+            stored.error_class = type(error).__name__
+            stored.error_message = str(error)
+            if stored.retries >= self.max_retries:
+                stored.status = "abandoned"
+            else:
+                stored.next_attempt_at = datetime.utcnow() + retry_delay(
+                    stored.retries
+                )
+            session.commit()
+
+    def retry_due(self, handlers, limit=100):
+        """Run the handler of each due letter, `handlers` maps kind to a
+        function taking the payload. Returns (resolved, failed)."""
+        resolved = failed = 0
+        for letter in self.due(limit):
+            try:
+                handlers[letter.kind](letter.payload)
+            except Exception as e:
+                print(f"Retry of {letter.kind} {letter.key} failed: {e}")
+                self.reschedule(letter, e)
+                failed += 1
+            else:
+                self.resolve(letter)
+                resolved += 1
+        return resolved, failed
+
+
+@lru_cache(maxsize=None)
+def get_dead_letter_store():
+    # one store per process
+    return DeadLetterStore()
@@ -0,0 +1,292 @@
+from .db_connection import BackfillTask, RateLimit
+from datetime import timedelta
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import threading
+import time
+
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+# Fields of a leased task handed to the workers
+TASK_FIELDS = ("id", "kind", "key", "payload", "batch_id", "attempts")
+
+
+def _task_dict(task):
+    return {field: getattr(task, field) for field in TASK_FIELDS}
+
+
+class LeaseLost(Exception):
+    """The lease of a task expired and it may be running on another worker."""
+
+
+class PostgresTaskQueue:
+    """Work queue shared by every worker node, backed by the dof_tasks table.
+
+    Tasks are leased with SELECT ... FOR UPDATE SKIP LOCKED, a lease that is
+    not renewed with heartbeat() expires and the task is picked up again by
+    another worker.
+    """
+
+    def __init__(
+        self, engine, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS
+    ):
+        self.engine = engine
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def create_tables(self):
+        BackfillTask.__table__.create(self.engine, checkfirst=True)
+        RateLimit.__table__.create(self.engine, checkfirst=True)
+
+    def enqueue(self, kind, key, payload, batch_id=None):
+        with Session(self.engine) as session:
+            session.execute(
+                insert(BackfillTask)
+                .values(
+                    kind=kind,
+                    key=key,
+                    payload=payload,
+                    batch_id=batch_id,
+                    status="pending",
+                    attempts=0,
+                )
+                .on_conflict_do_nothing(index_elements=["kind", "key"])
+            )
+            session.commit()
+
+    def lease(self, worker_id):
+        with Session(self.engine) as session:
+            # a lease that expired on the last attempt is not handed out again
+            session.execute(
+                update(BackfillTask)
+                .where(
+                    BackfillTask.status == "leased",
+                    BackfillTask.lease_expires_at < func.now(),
+                    BackfillTask.attempts >= self.max_attempts,
+                )
+                .values(status="failed", leased_by=None, last_error="lease expired")
+            )
+            task = session.scalars(
+                select(BackfillTask)
+                .where(
+                    or_(
+                        BackfillTask.status == "pending",
+                        and_(
+                            BackfillTask.status == "leased",
+                            BackfillTask.lease_expires_at < func.now(),
+                            BackfillTask.attempts < self.max_attempts,
+                        ),
+                    )
+                )
+                .order_by(BackfillTask.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if task is None:
+                session.commit()
+                return None
+            task.status = "leased"
+            task.leased_by = worker_id
+            task.attempts += 1
+            task.lease_expires_at = func.now() + timedelta(seconds=self.lease_seconds)
+            leased = _task_dict(task)
+            session.commit()
+            return leased
+
+    def _update_owned(self, task, worker_id, **values):
+        with Session(self.engine) as session:
+            result = session.execute(
+                update(BackfillTask)
+                .where(
+                    BackfillTask.id == task["id"],
+                    BackfillTask.leased_by == worker_id,
+                    BackfillTask.status == "leased",
+                )
+                .values(**values)
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def heartbeat(self, task, worker_id):
+        return self._update_owned(
+            task,
+            worker_id,
+            lease_expires_at=func.now() + timedelta(seconds=self.lease_seconds),
+        )
+
+    def complete(self, task, worker_id):
+        return self._update_owned(task, worker_id, status="done", leased_by=None)
+
+    def release(self, task, worker_id, error=None):
+        status = "failed" if task["attempts"] >= self.max_attempts else "pending"
+        return self._update_owned(
+            task, worker_id, status=status, leased_by=None, last_error=error
+        )
+
+
+class LocalTaskQueue:
+    """In-process stand-in for PostgresTaskQueue, for tests and single node runs."""
+
+    def __init__(self, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.tasks = {}
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def create_tables(self):
+        pass
+
+    def enqueue(self, kind, key, payload, batch_id=None):
+        with self._lock:
+            if (kind, key) in self._keys:
+                return
+            self._keys.add((kind, key))
+            task_id = len(self.tasks) + 1
+            self.tasks[task_id] = {
+                "id": task_id,
+                "kind": kind,
+                "key": key,
+                "payload": payload,
+                "batch_id": batch_id,
+                "attempts": 0,
+                "status": "pending",
+                "leased_by": None,
+                "lease_expires_at": None,
+                "last_error": None,
+            }
+
+    def lease(self, worker_id):
+        now = time.monotonic()
+        with self._lock:
+            for task in self.tasks.values():
+                expired = (
+                    task["status"] == "leased" and task["lease_expires_at"] < now
+                )
+                if expired and task["attempts"] >= self.max_attempts:
+                    task.update(
+                        status="failed", leased_by=None, last_error="lease expired"
+                    )
+                    continue
+                if task["status"] == "pending" or expired:
+                    task["status"] = "leased"
+                    task["leased_by"] = worker_id
+                    task["attempts"] += 1
+                    task["lease_expires_at"] = now + self.lease_seconds
+                    return {field: task[field] for field in TASK_FIELDS}
+        return None
+
+    def _update_owned(self, task, worker_id, **values):
+        with self._lock:
+            stored = self.tasks[task["id"]]
+            if stored["leased_by"] != worker_id or stored["status"] != "leased":
+                return False
+            stored.update(values)
+            return True
+
+    def heartbeat(self, task, worker_id):
+        return self._update_owned(
+            task, worker_id, lease_expires_at=time.monotonic() + self.lease_seconds
+        )
+
+    def complete(self, task, worker_id):
+        return self._update_owned(task, worker_id, status="done", leased_by=None)
+
+    def release(self, task, worker_id, error=None):
+        status = "failed" if task["attempts"] >= self.max_attempts else "pending"
+        return self._update_owned(
+            task, worker_id, status=status, leased_by=None, last_error=error
+        )
+
+
+class LeaseHeartbeat:
+    """Context manager renewing the lease of `task` from a background thread.
+
+    Once the queue reports the lease as lost, check() raises LeaseLost so the
+    worker stops instead of duplicating the work of the new lease holder.
+    """
+
+    def __init__(self, queue, task, worker_id, interval=None):
+        self.queue = queue
+        self.task = task
+        self.worker_id = worker_id
+        self.interval = interval or queue.lease_seconds / 3
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                renewed = self.queue.heartbeat(self.task, self.worker_id)
+            except Exception as e:
+                print(f"Failed to renew lease of task {self.task['id']}: {e}")
+                continue
+            if not renewed:
+                print(f"Lost the lease of task {self.task['id']}")
+                self.lost.set()
+                return
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"Lease of task {self.task['id']} was lost")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class PostgresRateLimiter:
+    """Request rate per site shared by all worker nodes.
+
+    Each acquire() reserves the next free slot of the site in dof_rate_limits
+    and sleeps until it, so the global rate stays under `rate` requests per
+    second no matter how many nodes are running.
+    """
+
+    def __init__(self, engine, rate):
+        self.engine = engine
+        self.interval = timedelta(seconds=1 / rate)
+
+    def acquire(self, site):
+        with Session(self.engine) as session:
+            session.execute(
+                insert(RateLimit)
+                .values(site=site, next_allowed_at=func.now())
+                .on_conflict_do_nothing(index_elements=["site"])
+            )
+            now, next_allowed_at = session.execute(
+                select(func.now(), RateLimit.next_allowed_at)
+                .where(RateLimit.site == site)
+                .with_for_update()
+            ).one()
+            slot = max(now, next_allowed_at)
+            session.execute(
+                update(RateLimit)
+                .where(RateLimit.site == site)
+                .values(next_allowed_at=slot + self.interval)
+            )
+            session.commit()
+        time.sleep((slot - now).total_seconds())
+
+
+class LocalRateLimiter:
+    """In-process stand-in for PostgresRateLimiter."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_allowed_at = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, site):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed_at.get(site, now))
+            self._next_allowed_at[site] = slot + self.interval
+        time.sleep(slot - now)
@@ -1,149 +1,449 @@
-import json
-from database.db_connection import get_connection
-from database.db_operations import upload_to_db
-from scraper.base_scraper import BaseScraper
-from scraper.diario_oficial_scraper import (
-    DiarioOficialScraper,
-    soup_to_dictionary,
-    fetch_url,
-    parse_html,
-)
-from parser.pdf_parser import PdfParser
-from utils.helpers import clean_text, parse_json, get_dates_in_range, trim_text
+import argparse
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from multiprocessing import Pool
+from threading import BoundedSemaphore
+from urllib.parse import urlparse
 from processor.openai_processor import (
     openai_setup,
     get_incorporation_entities,
     get_modification_entities,
     function_disolucion,
 )
-import uuid
-import logging
-from json.decoder import JSONDecodeError
-from dotenv import load_dotenv
-import os
-import time
-import random
-from parser.proxy_rotation import get_gateway, shutdown_gateway
-from multiprocessing import Pool
-
+from processor.rule_processor import RuleFastPath
+from utils.helpers import clean_text, iter_dates_in_range, trim_offset, trimmed_text
 
-logging.basicConfig(level=logging.INFO)
+# Importing this module has no side effects, and SQLAlchemy, PyPDF2, bs4,
+# boto3 and openai are imported where they are used, so --help and every
+# spawned pool worker start fast. Resources are created on first use.
 
 MIN_DELAY = 0.01
 MAX_DELAY = 0.3
-
-# Initialize apigateway for proxy rotation
+# Dates handed to the pool but not finished yet, per worker process. Bounds
+# memory on long backfills while keeping every worker busy
+IN_FLIGHT_PER_PROCESS = 2
+# Requests per second to each site, shared by every worker node
+SITE_RATE = 5
+IDLE_POLL_SECONDS = 30
+# Records sent in one Batch API job by the batch mode
+BATCH_SIZE = 1000
 
 base_url = "https://www.diariooficial.interior.gob.cl"
-gateway = get_gateway(base_url)
-
-load_dotenv()  # take environment variables from .env.
-# establish db connection
-logging.info("Establishing server connection")
-engine = get_connection(
-    user=os.getenv("AZURE_DB_USER"),
-    password=os.getenv("AZURE_DB_PASSWORD"),
-    host=os.getenv("AZURE_DB_HOST"),
-)
-# establish openai connection
-logging.info("Establishing OpenAI connection")
-openai_setup(secrets=os.getenv("API_KEY"))
+site = urlparse(base_url).netloc
+
 # establish openai functions
+# the rule based extractor handles templated extracts, the LLM only gets
+# the documents it can't parse with enough confidence
 functions = {
-    "CONSTITUCIÓN": get_incorporation_entities,
-    "MODIFICACIÓN": get_modification_entities,
-    "DISOLUCIÓN": function_disolucion,
+    "CONSTITUCIÓN": RuleFastPath(get_incorporation_entities, "CONSTITUCIÓN"),
+    "MODIFICACIÓN": RuleFastPath(get_modification_entities, "MODIFICACIÓN"),
+    "DISOLUCIÓN": RuleFastPath(function_disolucion, "DISOLUCIÓN"),
 }
 
 
-def main():
+def get_engine():
+    from database.db_connection import get_connection
+
+    # establish db connection, cached per process by get_connection
+    return get_connection(
+        user=os.getenv("AZURE_DB_USER"),
+        password=os.getenv("AZURE_DB_PASSWORD"),
+        host=os.getenv("AZURE_DB_HOST"),
+    )
+
+
+def main(from_date="01-12-2017", to_date="01-09-2018", refresh=False):
+    from parser.proxy_rotation import get_gateway
+
     # Unique batch id for this run
     batch_id = str(uuid.uuid4())  # create DiarioOficialScraper instance
     # Set date range (optional), Can be set to None, in which case it will default to only Today
-    publication_date_range = get_dates_in_range("01-12-2017", "01-09-2018")
-    with Pool() as p:
-        p.starmap(
-            process_date,
-            [
-                (
-                    date,
-                    functions,
-                    os.getenv("AZURE_DB_USER"),
-                    os.getenv("AZURE_DB_PASSWORD"),
-                    os.getenv("AZURE_DB_HOST"),
-                    batch_id,
-                )
-                for date in iter_dates(publication_date_range)
-            ],
+    publication_date_range = iter_dates_in_range(from_date, to_date)
+    tasks = (
+        (
+            date,
+            functions,
+            os.getenv("AZURE_DB_USER"),
+            os.getenv("AZURE_DB_PASSWORD"),
+            os.getenv("AZURE_DB_HOST"),
+            batch_id,
+            refresh,
         )
+        for date in publication_date_range
+    )
+    processes = os.cpu_count() or 1
+    in_flight = BoundedSemaphore(IN_FLIGHT_PER_PROCESS * processes)
+    # Initialize apigateway for proxy rotation before forking the workers
+    get_gateway(base_url)
+    with Pool(processes, initializer=init_worker) as p:
+        # the pool feeds tasks from a background thread, it blocks on the
+        # semaphore until a result is consumed here
+        for _ in p.imap_unordered(process_date_task, bounded(tasks, in_flight)):
+            in_flight.release()
+
+
+def init_worker():
+    logging.basicConfig(level=logging.INFO)
+
+
+def bounded(iterable, semaphore):
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
 
+def process_date_task(args):
+    return process_date(*args)
+
+
+def process_date(
+    publication_date, functions, user, password, host, batch_id, refresh=False
+):
+    from database.db_connection import get_connection
+    from scraper.diario_oficial_scraper import DiarioOficialScraper
+    from scraper.index_cache import IndexCache
 
-def process_date(publication_date, functions, user, password, host, batch_id):
     # establish db connection
     engine = get_connection(user=user, password=password, host=host)
+    cache = IndexCache(refresh=refresh)
 
     diario_oficial = DiarioOficialScraper(publication_date)
     logging.info(f"Scraping for publication date: {diario_oficial.date}")
-    editions = diario_oficial.fetch_editions()
+    editions = diario_oficial.fetch_editions(cache)
     logging.info(f"Found {len(editions)} editions for {diario_oficial.date}")
 
     for edition in editions:
-        process_edition(edition, functions, publication_date, engine, batch_id)
+        process_edition(
+            edition, functions, diario_oficial.date, engine, batch_id, cache=cache
+        )
+
 
-    # Create a generator that yields one date at a time
+def enqueue_dates(queue, dates, batch_id):
+    for date in dates:
+        queue.enqueue("date", date, {"date": date}, batch_id)
 
 
-def iter_dates(dates):
-    if dates is None:
-        yield None
+def run_worker(
+    queue, limiter, functions, engine, exit_when_empty=False, refresh=False
+):
+    from database.task_queue import LeaseHeartbeat, LeaseLost
+
+    # Pull tasks from the shared queue until it is empty (or forever)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    while True:
+        task = queue.lease(worker_id)
+        if task is None:
+            if exit_when_empty:
+                return
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+        with LeaseHeartbeat(queue, task, worker_id) as heartbeat:
+            try:
+                run_task(
+                    queue, limiter, task, functions, engine, heartbeat, refresh
+                )
+            except LeaseLost:
+                # the task belongs to another worker now, leave it to it
+                logging.warning(f"Task {task['kind']} {task['key']} lost its lease")
+            except Exception as e:
+                logging.exception(f"Task {task['kind']} {task['key']} failed")
+                queue.release(task, worker_id, error=repr(e))
+            else:
+                queue.complete(task, worker_id)
+
+
+def run_task(
+    queue, limiter, task, functions, engine, heartbeat=None, refresh=False
+):
+    from scraper.diario_oficial_scraper import DiarioOficialScraper
+    from scraper.index_cache import IndexCache
+
+    payload = task["payload"]
+    cache = IndexCache(refresh=refresh)
+    if task["kind"] == "date":
+        # a date fans out into one task per edition
+        diario_oficial = DiarioOficialScraper(payload["date"])
+        limiter.acquire(site)
+        editions = diario_oficial.fetch_editions(cache)
+        logging.info(f"Found {len(editions)} editions for {diario_oficial.date}")
+        if heartbeat:
+            heartbeat.check()
+        for edition in editions:
+            queue.enqueue(
+                "edition",
+                edition,
+                {"date": payload["date"], "edition": edition},
+                task["batch_id"],
+            )
     else:
-        for date in dates:
-            yield date
+        process_edition(
+            payload["edition"],
+            functions,
+            payload["date"],
+            engine,
+            task["batch_id"],
+            limiter,
+            cache,
+            heartbeat=heartbeat,
+        )
 
-      
 
-def process_edition(edition, functions, publication_date, engine, batch_id):
+def process_edition(
+    edition,
+    functions,
+    publication_date,
+    engine,
+    batch_id,
+    limiter=None,
+    cache=None,
+    on_record=None,
+    heartbeat=None,
+):
+    from database.dead_letter import get_dead_letter_store
+    from scraper.diario_oficial_scraper import fetch_url, parse_edition_records
+    from scraper.index_cache import fetch_index
+
     # Convert the edition URL to point to the "empresas_cooperativas" section
     url_parts = edition.split("?")
     specific_url = f"https://www.diariooficial.interior.gob.cl/edicionelectronica/empresas_cooperativas.php?{url_parts[1]}"
     # fetch url and parse html
-    response = fetch_url(specific_url)
-    soup = parse_html(response)
-    # extract content and save it as a dictionary
-    contents = soup_to_dictionary(soup)
+    if limiter:
+        limiter.acquire(site)
+    if cache is None:
+        records = parse_edition_records(fetch_url(specific_url))
+    else:
+        # only the rows not seen on a previous run go to the pdf stage
+        entry, records, html = fetch_index(
+            cache,
+            publication_date,
+            url_parts[1],
+            specific_url,
+            fetch_url,
+            parse_edition_records,
+        )
+    # failed documents are stored for a later retry instead of aborting the edition
+    dead_letters = get_dead_letter_store()
     # iterate over the companies and their pdfs
-    logging.info("Starting extraction...")
-    for section, function in functions.items():
-        if "Sumario" in contents and "Empresas y Cooperativas" in contents["Sumario"]:
-            if section in contents["Sumario"]["Empresas y Cooperativas"]:
-                for sub_section in contents["Sumario"]["Empresas y Cooperativas"][
-                    section
-                ][""]:
-                    for item in contents["Sumario"]["Empresas y Cooperativas"][section][
-                        ""
-                    ][sub_section]:
-                        pdf_link = item["link"]
-                        # get the text content of the pdf
-                        logging.info(f"Parsing PDF link: {pdf_link}")
-                        time.sleep(
-                            random.uniform(MIN_DELAY, MAX_DELAY)
-                        )  # Be nice to the government
-                        item["text_content"] = PdfParser().get_pdf_text(pdf_link)
-                        item["clean_text_content"] = clean_text(item["text_content"])
-                        item["trimmed_text_content"] = trim_text(
-                            item["clean_text_content"]
-                        )
-                        item["section"] = section
-                        item["sub_section"] = sub_section
-                        item["publication_date"] = publication_date
-
-                        logging.info("Uploading record to database")
-                        upload_to_db(engine, item, batch_id)
-            else:
-                logging.info(f"No available content in section: {section}")
+    logging.info(f"Starting extraction of {len(records)} records...")
+    for item in records:
+        section, sub_section = item["section"], item["sub_section"]
+        if section not in functions:
+            continue
+        if heartbeat:
+            # stop as soon as the lease is lost, before the next upload
+            heartbeat.check()
+        if limiter:
+            limiter.acquire(urlparse(item["link"]).netloc)
+        else:
+            time.sleep(random.uniform(MIN_DELAY, MAX_DELAY))  # Be nice to the government
+        process_item(
+            item,
+            section,
+            sub_section,
+            publication_date,
+            engine,
+            batch_id,
+            dead_letters,
+            on_record,
+            functions,
+        )
+    if cache is not None:
+        # the new rows are processed (or dead lettered), remember them
+        cache.put(publication_date, url_parts[1], entry, html)
+
+
+def process_item(
+    item,
+    section,
+    sub_section,
+    publication_date,
+    engine,
+    batch_id,
+    dead_letters=None,
+    on_record=None,
+    functions=functions,
+):
+    from database.dead_letter import unwrap_error
+    from database.db_operations import upload_to_db
+    from parser.pdf_parser import PdfParser
+
+    pdf_link = item["link"]
+    # get the text content of the pdf
+    logging.info(f"Parsing PDF link: {pdf_link}")
+    try:
+        text_content = PdfParser().get_pdf_text(pdf_link)
+    except Exception as e:
+        if dead_letters is None:
+            raise
+        error, attempts = unwrap_error(e)
+        logging.error(f"Failed to parse {pdf_link} after {attempts} attempts: {error}")
+        dead_letters.add(
+            "pdf",
+            pdf_link,
+            {
+                "item": item,
+                "section": section,
+                "sub_section": sub_section,
+                "publication_date": publication_date,
+                "batch_id": batch_id,
+            },
+            e,
+        )
+        return
+    clean_text_content = clean_text(text_content)
+    # the trimmed text is a suffix of the clean text, keep only its offset,
+    # None when "EXTRACTO" was not found (see the materialization in README)
+    record = {
+        **item,
+        "text_content": text_content,
+        "clean_text_content": clean_text_content,
+        "trimmed_text_offset": trim_offset(clean_text_content),
+        "section": section,
+        "sub_section": sub_section,
+        "publication_date": publication_date,
+    }
+
+    # rule based extraction, the LLM only for the extracts it can't parse
+    try:
+        record["entities"] = functions[section](trimmed_text(record))
+    except Exception as e:
+        if dead_letters is None:
+            raise
+        error, attempts = unwrap_error(e)
+        logging.error(f"Failed to extract {pdf_link} after {attempts} attempts: {error}")
+        dead_letters.add("llm", pdf_link, {"record": record, "batch_id": batch_id}, e)
+        return
+
+    logging.info("Uploading record to database")
+    try:
+        uploaded = upload_to_db(engine, record, batch_id)
+    except Exception as e:
+        if dead_letters is None:
+            raise
+        error, attempts = unwrap_error(e)
+        logging.error(f"Failed to upload {pdf_link} after {attempts} attempts: {error}")
+        dead_letters.add("db", pdf_link, {"record": record, "batch_id": batch_id}, e)
+        return
+    if uploaded and on_record is not None:
+        on_record(record)
+
+
+def run_batch(engine, client=None, batch_id=None, limit=BATCH_SIZE):
+    """Extract the entities of stored records through the Batch API and save
+    them. Returns the number of records sent."""
+    from database.db_operations import (
+        hydrate_record,
+        load_unextracted_records,
+        save_extractions,
+    )
+    from processor.openai_processor import OpenaiProcessor
+    from processor.schemas import SCHEMAS
+
+    rows = load_unextracted_records(engine, SCHEMAS, batch_id, limit)
+    records, missing = [], []
+    for row_id, payload in rows:
+        # the texts of the stored records are in dof_texts
+        record = {**hydrate_record(engine, payload), "id": row_id}
+        if "clean_text_content" in record or "trimmed_text_content" in record:
+            records.append(record)
         else:
-            logging.info("Reached end of file")
+            record["extraction_error"] = {
+                "code": "MissingText",
+                "message": f"No text stored for {record.get('link')}",
+            }
+            missing.append(record)
+    logging.info(f"Extracting {len(records)} records, {len(missing)} without text")
+    OpenaiProcessor(records, client).process()
+    save_extractions(engine, records + missing)
+    return len(records)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Diario Oficial backfill")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        default="local",
+        choices=["local", "enqueue", "worker", "batch"],
+        help="local: process the range with a pool on this machine, "
+        "enqueue: add the range to the shared queue, "
+        "worker: process tasks from the shared queue, "
+        "batch: extract the stored records without entities with the Batch API",
+    )
+    parser.add_argument("--from-date", default="01-12-2017")
+    parser.add_argument("--to-date", default="01-09-2018")
+    parser.add_argument("--exit-when-empty", action="store_true")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignore the index cache and process every row of the dates again",
+    )
+    parser.add_argument("--batch-id", help="batch: only the records of this run")
+    parser.add_argument("--limit", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="batch: call the chat completion endpoint instead of the Batch API",
+    )
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()  # take environment variables from .env.
+    openai_setup(secrets=os.getenv("API_KEY"))
+
+    from database.db_connection import create_tables
+    from database.dead_letter import DeadLetterStore
+
+    create_tables(get_engine())
+    # once here, the pool workers only write to it
+    DeadLetterStore().create_tables()
+
+    if args.mode == "enqueue":
+        from database.task_queue import PostgresTaskQueue
+
+        queue = PostgresTaskQueue(get_engine())
+        queue.create_tables()
+        enqueue_dates(
+            queue,
+            iter_dates_in_range(args.from_date, args.to_date),
+            str(uuid.uuid4()),
+        )
+    elif args.mode == "worker":
+        from database.task_queue import PostgresRateLimiter, PostgresTaskQueue
+        from parser.proxy_rotation import get_gateway
+
+        engine = get_engine()
+        get_gateway(base_url)
+        run_worker(
+            PostgresTaskQueue(engine),
+            PostgresRateLimiter(engine, SITE_RATE),
+            functions,
+            engine,
+            args.exit_when_empty,
+            args.refresh,
+        )
+    elif args.mode == "batch":
+        from processor.openai_processor import LocalBatchClient
+
+        run_batch(
+            get_engine(),
+            LocalBatchClient() if args.sync else None,
+            args.batch_id,
+            args.limit,
+        )
+    else:
+        main(args.from_date, args.to_date, args.refresh)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
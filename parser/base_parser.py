@@ -1,15 +1,31 @@
+import os
 import requests
 from .proxy_rotation import get_gateway
-from utils.helpers import retry_on_request
+from utils.helpers import retry_fast
+
+
+_session = None
+_session_pid = None
+
+
+def get_session():
+    # one keep-alive session per process with the gateway mounted once, never
+    # shared with forked workers
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        gateway = get_gateway()  # Get the existing gateway instance
+        _session = requests.Session()
+        _session.mount(gateway.site, gateway)
+        _session_pid = os.getpid()
+    return _session
+
 
 class BaseParser:
-    @retry_on_request
+    # failed downloads are dead lettered, the backoff is the scheduler's
+    @retry_fast
     def fetch_url(self, url):
         try:
-            gateway = get_gateway()  # Get the existing gateway instance
-            session = requests.Session()
-            session.mount(gateway.site, gateway)
-            response = session.get(url)
+            response = get_session().get(url)
             response.raise_for_status()  # Ensure we got a successful response
             return response
         except (ConnectionError, IOError) as e:
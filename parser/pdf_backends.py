@@ -0,0 +1,72 @@
+from io import BytesIO
+
+
+class PdfBackend:
+    """Text extraction library used by PdfParser, selected with PDF_BACKEND."""
+
+    name = None
+
+    def extract_pages(self, data):
+        """Return the text of every page of the PDF in `data` (bytes)."""
+        raise NotImplementedError
+
+    def extract_text(self, data):
+        return "".join(self.extract_pages(data))
+
+
+class PyPDF2Backend(PdfBackend):
+    name = "pypdf2"
+
+    def extract_pages(self, data):
+        from PyPDF2 import PdfReader
+
+        pdf_reader = PdfReader(BytesIO(data))
+        return [page.extract_text() for page in pdf_reader.pages]
+
+
+class PdfminerBackend(PdfBackend):
+    name = "pdfminer"
+
+    def extract_pages(self, data):
+        from pdfminer.high_level import extract_text
+
+        # pages are separated by form feeds, the last one closes the document
+        pages = extract_text(BytesIO(data)).split("\f")
+        return pages[:-1] if len(pages) > 1 and not pages[-1] else pages
+
+
+class PdfiumBackend(PdfBackend):
+    name = "pypdfium2"
+
+    def extract_pages(self, data):
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(data)
+        try:
+            pages = []
+            for page in pdf:
+                text_page = page.get_textpage()
+                pages.append(text_page.get_text_range())
+                text_page.close()
+                page.close()
+            return pages
+        finally:
+            pdf.close()
+
+
+BACKENDS = {
+    backend.name: backend for backend in (PyPDF2Backend, PdfminerBackend, PdfiumBackend)
+}
+
+
+def get_backend(name=None):
+    if name is None:
+        from settings import PDF_BACKEND
+
+        name = PDF_BACKEND
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown PDF backend {name!r}, available: {', '.join(BACKENDS)}"
+        ) from None
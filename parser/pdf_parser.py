@@ -1,27 +1,20 @@
 from .base_parser import BaseParser
-from PyPDF2 import PdfReader
-from io import BytesIO
-from utils.helpers import retry_on_request
+from .pdf_backends import PdfBackend, get_backend
 
 
 class PdfParser(BaseParser):
-    @retry_on_request
+    def __init__(self, backend=None):
+        # a backend name, an instance or None for the configured PDF_BACKEND
+        if not isinstance(backend, PdfBackend):
+            backend = get_backend(backend)
+        self.backend = backend
+
+    def extract_text(self, data):
+        return self.backend.extract_text(data)
+
+    # fetch_url already retries, retrying here too made up to 9 attempts
     def get_pdf_text(self, pdf_link):
         # Download the file
         response = self.fetch_url(pdf_link)
 
-        # Create a BytesIO object from the response content
-        file = BytesIO(response.content)
-
-        # Create a PDF reader instance
-        pdf_reader = PdfReader(file)
-
-        # Initialize an empty string to store the text
-        text = ""
-
-        # Iterate over all the pages and extract text
-        for i in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[i]
-            text += page.extract_text()
-
-        return text
+        return self.extract_text(response.content)
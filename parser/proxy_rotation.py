@@ -1,14 +1,16 @@
-from requests_ip_rotator import ApiGateway
-from dotenv import load_dotenv
-
-load_dotenv()  # take environment variables from .env.
-
 _gateway = None
 
+DEFAULT_SITE = "https://www.diariooficial.interior.gob.cl"
+
 def get_gateway(base_url=None):
     global _gateway
     if _gateway is None:
-        _gateway = ApiGateway(base_url)
+        # boto3 is only imported when a gateway is actually needed
+        from dotenv import load_dotenv
+        from requests_ip_rotator import ApiGateway
+
+        load_dotenv()  # take environment variables from .env.
+        _gateway = ApiGateway(base_url or DEFAULT_SITE)
         _gateway.start()
     return _gateway
 
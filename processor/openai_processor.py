@@ -1,14 +1,37 @@
 from .base_processor import BaseProcessor
-import openai
-from utils.helpers import retry_on_request
+import json
+import os
+import tempfile
+import time
+import uuid
+from .schemas import SCHEMAS
+from utils.helpers import retry_on_request, trimmed_text
+
+
+MODEL = "gpt-3.5-turbo-0613"
+
+
+_api_key = None
 
 
 def openai_setup(secrets):
-    openai.api_key = secrets
+    global _api_key
+    _api_key = secrets
+
+
+def _openai():
+    # openai is imported on first use, spawned workers read the key from the
+    # environment when openai_setup was only called in the parent
+    import openai
+
+    if openai.api_key is None:
+        openai.api_key = _api_key or os.getenv("API_KEY")
+    return openai
 
 
 @retry_on_request
 def _openai_api_caller(model, messages, functions, function_call):
+    openai = _openai()
     try:
         response = openai.ChatCompletion.create(
             model=model,
@@ -43,273 +66,235 @@ def _openai_api_caller(model, messages, functions, function_call):
         raise
 
 
-class OpenaiProcessor(BaseProcessor):
-    def process(self):
-        ...
+def _function_request_body(function, pdf_text):
+    return {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": pdf_text}],
+        "functions": [function],
+        # force to call specific function
+        "function_call": {"name": function["name"]},
+    }
 
 
-def get_incorporation_entities(pdf_text):
-    messages = [{"role": "user", "content": pdf_text}]
-    functions = [
-        {
-            "name": "get_incorporation_entities",
-            "description": "Identify the main entities, participants and events in a company incorporation legal text",
-            "parameters": {
-                "title": "Legal Document",
-                "type": "object",
-                "properties": {
-                    "notary": {
-                        "type": "string",
-                    },
-                    "parties": {
-                        "type": "array",
-                        "description": "The persons or companies that are incorporating a new company",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "EntityType": {
-                                    "type": "string",
-                                    "enum": ["Individual", "ExistingCompany"],
-                                    "description": "Type of the incorporating entity, can be an individual or an existing company",
-                                },
-                                "EntityName": {
-                                    "type": "string",
-                                    "description": "the name of the individual or existing company that is incorporating a new company",
-                                },
-                                "TaxIdentifier": {
-                                    "type": "string",
-                                    "description": "the RUN, RUT, CI or tax ID of the individual or existing company that is incorporating a new company",
-                                },
-                                "OwnershipDetails": {
-                                    "type": "string",
-                                    "description": "Number of stocks or percentage of capital owned by individual or company",
-                                },
-                                "EntityAddress": {
-                                    "type": "string",
-                                    "description": "the personal address of the individual or existing company that is incorporating a new company",
-                                },
-                                "CompanyRepresentative": {
-                                    "type": "string",
-                                    "description": "if the incorporating entity is an existing company, name of the representative",
-                                },
-                            },
-                        },
-                    },
-                    "company": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string"},
-                            "capital": {"type": "number"},
-                            "registryDetails": {"type": "string"},
-                            "businessPurposeSummary": {
-                                "type": "string",
-                                "description": "Summary of the business purpose of the company in less than 10 words",
-                            },
-                        },
-                        "required": ["name", "RUT", "capital", "registryDetails"],
-                    },
-                },
-                "required": ["parties", "company"],
-            },
-        },
-    ]
+def _function_arguments(response):
+    return response["choices"][0]["message"]["function_call"]["arguments"]
+
+
+def _call_function(schema, pdf_text):
     response = _openai_api_caller(
-        model="gpt-3.5-turbo-0613",
-        messages=messages,
-        functions=functions,
-        function_call={
-            "name": "get_incorporation_entities"
-        },  # force to call specific function
+        **_function_request_body(schema.function, pdf_text)
     )
-    response_message = {}
+    return schema.parse(_function_arguments(response))
 
-    response_message = response["choices"][0]["message"]["function_call"]["arguments"]
 
-    return response_message
+class OpenaiBatchClient:
+    """Submits request files to the OpenAI Batch API (50% cheaper, 24h window)."""
 
+    base_url = "https://api.openai.com/v1"
 
-def get_modification_entities(pdf_text):
-    messages = [{"role": "user", "content": pdf_text}]
-    functions = [
-        {
-            "name": "get_modification_entities",
-            "description": "Get the main participants in a legal text",
-            "parameters": {
-                "title": "Legal Document",
-                "type": "object",
-                "properties": {
-                    "companyModifications": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "modificationType": {"type": "string"},
-                                "modificationDate": {
-                                    "type": "string",
-                                    "format": "date",
-                                },
-                                "modificationDetails": {"type": "string"},
-                            },
-                            "required": [
-                                "modificationType",
-                                "modificationDate",
-                                "modificationDetails",
-                            ],
-                        },
-                    },
-                    "company": {
-                        "type": "object",
-                        "properties": {
-                            "name": {"type": "string"},
-                            "capital": {"type": "number"},
-                            "registryDetails": {"type": "string"},
-                            "MainbusinessPurpose": {
-                                "type": "string",
-                                "description": "Summary of the business purpose of the company in less than 10 words",
-                            },
-                        },
-                        "required": ["name", "RUT", "capital", "registryDetails"],
-                    },
-                    "parties": {  # TODO: Unify JSON schema for incorporation, modification, dissolutionn
-                        "type": "array",
-                        "description": "The persons or companies that are modifying an existing company",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "EntityType": {
-                                    "type": "string",
-                                    "enum": ["Individual", "ExistingCompany"],
-                                    "description": "Type of the party, can be a person or a company",
-                                },
-                                "name": {"type": "string"},
-                                "RUN": {
-                                    "type": "string",
-                                    "description": "the RUN, RUT, CI or tax ID of the person or existing company",
-                                },
-                                "property_of_company": {
-                                    "type": "string",
-                                    "description": "Number of stocks or percentage of capital owned by person or company",
-                                },
-                                "address": {
-                                    "type": "string",
-                                    "description": "the address of the person or existing company",
-                                },
-                                "represented_by": {
-                                    "type": "string",
-                                    "description": "if the party is an existing company, name of the representative",
-                                },
-                            },
-                            "required": ["name", "RUN", "address"],
-                        },
-                    },
-                },
-                "required": ["companyModifications", "company", "parties"],
+    def __init__(self, api_key=None, completion_window="24h"):
+        self.api_key = api_key or _openai().api_key
+        self.completion_window = completion_window
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    @retry_on_request
+    def _request(self, method, path, **kwargs):
+        import requests
+
+        response = requests.request(
+            method, f"{self.base_url}{path}", headers=self.headers, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def submit(self, requests_path):
+        # read once, a retried upload must send the whole file again
+        with open(requests_path, "rb") as file:
+            content = file.read()
+        uploaded = self._request(
+            "POST",
+            "/files",
+            files={"file": (os.path.basename(requests_path), content)},
+            data={"purpose": "batch"},
+        ).json()
+        batch = self._request(
+            "POST",
+            "/batches",
+            json={
+                "input_file_id": uploaded["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": self.completion_window,
             },
-        },
-    ]
-    response = _openai_api_caller(
-        model="gpt-3.5-turbo-0613",
-        messages=messages,
-        functions=functions,
-        function_call={
-            "name": "get_modification_entities"
-        },  # force to call specific function
-    )
+        ).json()
+        return batch["id"]
 
-    response_message = {}
+    def status(self, batch_id):
+        return self._request("GET", f"/batches/{batch_id}").json()
 
-    response_message = response["choices"][0]["message"]["function_call"]["arguments"]
+    def results(self, batch):
+        lines = []
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if file_id:
+                content = self._request("GET", f"/files/{file_id}/content").text
+                lines.extend(json.loads(line) for line in content.splitlines() if line)
+        return lines
 
-    return response_message
 
+class LocalBatchClient:
+    """Stand-in for the Batch API that runs the request file synchronously.
 
-def function_disolucion(pdf_text):
-    messages = [{"role": "user", "content": pdf_text}]
-    functions = [
-        {
-            "name": "get_dissolution_entities",
-            "description": "Identify the main entities, participants and events in a company dissolution legal text",
-            "parameters": {
-                "title": "Legal Document",
-                "type": "object",
-                "properties": {
-                    "parties": {
-                        "type": "array",
-                        "description": "The persons or companies that are ending a company",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "party_type": {
-                                    "type": "string",
-                                    "enum": ["person", "company"],
-                                    "description": "Type of the party, can be a person or a company",
-                                },
-                                "name": {"type": "string"},
-                                "RUN": {
-                                    "type": "string",
-                                    "description": "the RUN, RUT, CI or tax ID of the person or existing company",
-                                },
-                                "property_of_company": {
-                                    "type": "string",
-                                    "description": "Number of stocks or percentage of capital owned by person or company",
-                                },
-                                "address": {
-                                    "type": "string",
-                                    "description": "the address of the person or existing company",
-                                },
-                                "represented_by": {
-                                    "type": "string",
-                                    "description": "if the party is an existing company, name of the representative",
-                                },
-                            },
-                            "required": ["name", "RUN", "address"],
-                        },
-                    },
-                    "company": {
-                        "type": "object",
-                        "properties": {
-                            "registryDetails": {"type": "string"},
-                            "endBalanceDate": {
-                                "type": "string",
-                                "description": "the date of the end balance of the company",
-                            },
-                        },
-                        "required": ["name", "RUT", "registryDetails"],
-                    },
-                    "dissolutionDetails": {
-                        "type": "object",
-                        "properties": {
-                            "dissolutionDate": {
-                                "type": "string",
-                                "description": "the date of the dissolution of the company",
-                            },
-                            "liquidationProcedure": {
-                                "type": "string",
-                                "description": "details on how the liquidation of the company will be handled",
-                            },
-                            "capitalDetails": {
-                                "type": "string",
-                                "description": "details about the capital of the company at the time of dissolution",
-                            },
-                        },
-                        "required": ["dissolutionDate"],
-                    },
-                },
-                "required": ["parties", "company", "dissolutionDetails"],
-            },
+    Useful for tests and small runs, `caller` defaults to the synchronous
+    chat completion endpoint.
+    """
+
+    def __init__(self, caller=None):
+        self.caller = caller or _openai_api_caller
+        self._batches = {}
+
+    def submit(self, requests_path):
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        results = []
+        with open(requests_path, encoding="utf-8") as file:
+            for line in file:
+                request = json.loads(line)
+                try:
+                    body = self.caller(**request["body"])
+                    result = {"response": {"status_code": 200, "body": body}}
+                except Exception as e:
+                    result = {"error": {"code": type(e).__name__, "message": str(e)}}
+                result["custom_id"] = request["custom_id"]
+                results.append(result)
+        self._batches[batch_id] = results
+        return batch_id
+
+    def status(self, batch_id):
+        return {"id": batch_id, "status": "completed"}
+
+    def results(self, batch):
+        return self._batches.pop(batch["id"])
+
+
+class OpenaiProcessor(BaseProcessor):
+    """Extracts the entities of a batch of records through the Batch API.
+
+    `data` is a list of records as built by the scraper, the trimmed text is
+    extracted unless `text_key` names another field. Each record is written
+    as one line of a JSONL request file, the file is submitted to `client`
+    and, once the batch is done, the function arguments are joined back to
+    the records by id.
+    """
+
+    FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(
+        self,
+        data,
+        client=None,
+        text_key=None,
+        poll_interval=60,
+        timeout=24 * 60 * 60,
+        requests_path=None,
+    ):
+        super().__init__(data)
+        self.client = client or OpenaiBatchClient()
+        self.text_key = text_key
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.requests_path = requests_path
+
+    def _record_id(self, index, record):
+        return str(record.get("id", index))
+
+    def write_requests(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            for index, record in enumerate(self.data):
+                schema = SCHEMAS[record["section"]]
+                if self.text_key:
+                    text = record[self.text_key]
+                else:
+                    text = trimmed_text(record)
+                request = {
+                    "custom_id": self._record_id(index, record),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": _function_request_body(schema.function, text),
+                }
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        return path
+
+    def wait(self, batch_id):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            batch = self.client.status(batch_id)
+            if batch["status"] in self.FINAL_STATUSES:
+                return batch
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch {batch_id} did not finish in time")
+            time.sleep(self.poll_interval)
+
+    def join_results(self, results, batch=None):
+        records = {
+            self._record_id(index, record): record
+            for index, record in enumerate(self.data)
         }
-    ]
-    response = _openai_api_caller(
-        model="gpt-3.5-turbo-0613",
-        messages=messages,
-        functions=functions,
-        function_call={
-            "name": "get_dissolution_entities"
-        },  # force to call specific function
-    )
+        for result in results:
+            record = records.get(result["custom_id"])
+            if record is None:
+                continue
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                record["extraction_error"] = result.get("error") or response.get("body")
+                continue
+            schema = SCHEMAS[record["section"]]
+            try:
+                record["entities"] = schema.parse(
+                    _function_arguments(response["body"])
+                )
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                # a malformed body only fails its own record
+                record["extraction_error"] = {
+                    "code": "InvalidArguments",
+                    "message": str(e),
+                }
+        # a failed, expired or cancelled batch has no result for some (or
+        # all) of its records, they must not look like they were never sent
+        batch = batch or {}
+        for record in records.values():
+            if "entities" not in record and "extraction_error" not in record:
+                record["extraction_error"] = {
+                    "code": "MissingResult",
+                    "message": f"No result in batch {batch.get('id')} "
+                    f"with status {batch.get('status')}",
+                    "errors": batch.get("errors"),
+                }
+        return self.data
+
+    def process(self):
+        if not self.data:
+            return self.data
+        path = self.requests_path
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="dof_batch_", suffix=".jsonl")
+            os.close(fd)
+        try:
+            self.write_requests(path)
+            batch = self.wait(self.client.submit(path))
+            return self.join_results(self.client.results(batch), batch)
+        finally:
+            if self.requests_path is None:
+                os.remove(path)
 
-    response_message = {}
 
-    response_message = response["choices"][0]["message"]["function_call"]["arguments"]
+def get_incorporation_entities(pdf_text):
+    return _call_function(SCHEMAS["CONSTITUCIÓN"], pdf_text)
+
+
+def get_modification_entities(pdf_text):
+    return _call_function(SCHEMAS["MODIFICACIÓN"], pdf_text)
+
 
-    return response_message
+def function_disolucion(pdf_text):
+    return _call_function(SCHEMAS["DISOLUCIÓN"], pdf_text)
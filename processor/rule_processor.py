@@ -0,0 +1,300 @@
+from .base_processor import BaseProcessor
+from .schemas import SCHEMAS
+import re
+from utils.constants import MIN_RULE_CONFIDENCE
+from utils.helpers import parse_amount
+
+
+MONTHS = {
+    "enero": 1,
+    "febrero": 2,
+    "marzo": 3,
+    "abril": 4,
+    "mayo": 5,
+    "junio": 6,
+    "julio": 7,
+    "agosto": 8,
+    "septiembre": 9,
+    "setiembre": 9,
+    "octubre": 10,
+    "noviembre": 11,
+    "diciembre": 12,
+}
+
+_NAME_WORD = r"[A-ZÁÉÍÓÚÑ][A-Za-zÁÉÍÓÚÑáéíóúñü\.]+"
+_NAME = rf"{_NAME_WORD}(?:\s+(?:de\s+la\s+|de\s+|del\s+)?{_NAME_WORD}){{1,5}}"
+_RUT = r"\d{1,2}\.?\d{3}\.?\d{3}-[\dkK]"
+# Words preceding a name in the template, they are not part of it
+_NOT_A_NAME = r"(?!(?i:extracto|ante|por|don|doña|se|que)\b)"
+
+# Patterns are compiled once at import, texts are already cleaned by clean_text
+NOTARY_RE = re.compile(rf"\b{_NOT_A_NAME}({_NAME}),?\s+(?i:Notari[oa])\b")
+COMPANY_NAME_RE = re.compile(
+    r"(?:raz[oó]n\s+social|denominaci[oó]n|denominada|sociedad)[^\"“«.]{0,40}?"
+    r"[\"“«]([^\"”»]{3,150})[\"”»]",
+    re.IGNORECASE,
+)
+# The RUT of the company only when it follows its name, the first RUT of an
+# extract is usually the RUN of one of the parties
+COMPANY_RUT_RE = re.compile(
+    r"\s*,?\s*(?:Rol\s+[ÚU]nico\s+Tributario|R\.?\s?U\.?\s?T\.?)\s*"
+    rf"(?:N[°º\.o]*\s*)?:?\s*({_RUT})\b",
+    re.IGNORECASE,
+)
+# A name followed by a few lowercase descriptors (nationality, civil status,
+# profession) and an identity or tax number
+PARTY_RE = re.compile(
+    rf"\b{_NOT_A_NAME}({_NAME})\s*,\s*(?:[A-Za-zÁÉÍÓÚÑáéíóúñü ]{{1,40}},\s*){{0,4}}"
+    r"(?i:(c[ée]dula(?:\s+(?:nacional\s+)?(?:de\s+)?identidad)?|C\.?\s?I\.?|R\.?\s?U\.?\s?N\.?)"
+    r"|(R\.?\s?U\.?\s?T\.?|Rol\s+[úu]nico\s+tributario))"
+    rf"\s*(?:N[°º\.o]*\s*)?:?\s*({_RUT})\b"
+)
+CAPITAL_RE = re.compile(
+    r"capital\b[^$]{0,80}?\$\s*((?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?)",
+    re.IGNORECASE,
+)
+REPERTORIO_RE = re.compile(
+    r"Repertorio\s*(?:N[°º\.o]*\s*)?:?\s*(\d[\d\./-]*\d|\d)", re.IGNORECASE
+)
+LONG_DATE_RE = re.compile(
+    r"\b(\d{1,2})\s+de\s+(" + "|".join(MONTHS) + r")\s+(?:de|del)\s+(\d{4})\b",
+    re.IGNORECASE,
+)
+SHORT_DATE_RE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b")
+# A period or semicolon closing a sentence, not the ones inside 1.000.000 or S.A.
+SENTENCE_END_RE = re.compile(r"[.;](?=\s|$)")
+# Kinds of amendment found in modification extracts, first match wins
+MODIFICATION_TYPES = [
+    (re.compile(p, re.IGNORECASE), kind)
+    for p, kind in [
+        (r"transform\w*", "transformación"),
+        (r"fusi[oó]n|fusion\w*|absorb\w*", "fusión"),
+        (r"divisi[oó]n|divid\w*", "división"),
+        (r"aument\w*\s+(?:el\s+|del\s+)?capital", "aumento de capital"),
+        (r"disminu\w*\s+(?:el\s+|del\s+)?capital", "disminución de capital"),
+        (r"(?:cesi[oó]n|cedi[oó]|cede)\w*", "cesión de derechos"),
+        (
+            r"retir[oa]\w*\s+(?:de\s+(?:la\s+)?sociedad|como\s+socio)",
+            "retiro de socio",
+        ),
+        (
+            r"ingres[oa]\w*\s+(?:a\s+(?:la\s+)?sociedad|como\s+socio)",
+            "ingreso de socio",
+        ),
+        (r"(?:raz[oó]n\s+social|nombre)", "cambio de razón social"),
+        (r"domicilio", "cambio de domicilio"),
+        (r"objeto", "cambio de objeto"),
+        (r"administraci[oó]n", "cambio de administración"),
+    ]
+]
+MODIFIED_RE = re.compile(r"\bmodific\w*|\breform\w*", re.IGNORECASE)
+DISSOLVED_RE = re.compile(r"\bdisol\w*|\bdisuel\w*|\bdisuelve\b", re.IGNORECASE)
+LIQUIDATION_RE = re.compile(r"\bliquida\w*", re.IGNORECASE)
+# Window after the dissolution keyword in which its date is looked for
+DISSOLUTION_DATE_WINDOW = 200
+
+# Weight of each field in the confidence score of a section, they add up to 1.
+# The fields required by the section's function schema are also checked
+# before the rule based result is used.
+SECTION_FIELD_WEIGHTS = {
+    "CONSTITUCIÓN": {
+        "name": 0.25,
+        "capital": 0.2,
+        "registryDetails": 0.15,
+        "parties": 0.2,
+        "notary": 0.1,
+        "deedDate": 0.1,
+    },
+    "MODIFICACIÓN": {
+        "name": 0.25,
+        "registryDetails": 0.15,
+        "parties": 0.2,
+        "modifications": 0.2,
+        "notary": 0.1,
+        "deedDate": 0.1,
+    },
+    "DISOLUCIÓN": {
+        "name": 0.25,
+        "registryDetails": 0.15,
+        "parties": 0.2,
+        "dissolution": 0.2,
+        "notary": 0.1,
+        "deedDate": 0.1,
+    },
+}
+
+
+def parse_dates(text):
+    dates = []
+    for match in LONG_DATE_RE.finditer(text):
+        day, month, year = match.groups()
+        dates.append((match.start(), int(year), MONTHS[month.lower()], int(day)))
+    for match in SHORT_DATE_RE.finditer(text):
+        day, month, year = match.groups()
+        dates.append((match.start(), int(year), int(month), int(day)))
+    # in order of appearance, the deed date comes first
+    return [
+        (position, f"{year:04d}-{month:02d}-{day:02d}")
+        for position, year, month, day in sorted(dates)
+        if 1 <= month <= 12 and 1 <= day <= 31
+    ]
+
+
+def parse_parties(text, company_rut=None):
+    parties = []
+    seen = {company_rut}
+    for match in PARTY_RE.finditer(text):
+        name, individual, company, rut = match.groups()
+        rut = rut.upper()
+        if rut in seen:
+            continue
+        seen.add(rut)
+        parties.append(
+            {
+                "entityType": "Individual" if individual else "ExistingCompany",
+                "name": name.strip(),
+                "taxId": rut,
+            }
+        )
+    return parties
+
+
+def sentence_at(text, position):
+    ends = [match.end() for match in SENTENCE_END_RE.finditer(text, 0, position)]
+    end = SENTENCE_END_RE.search(text, position)
+    return text[ends[-1] if ends else 0 : end.start() if end else len(text)].strip()
+
+
+def parse_modifications(text, deed_date):
+    modifications = []
+    for match in MODIFIED_RE.finditer(text):
+        sentence = sentence_at(text, match.start())
+        for pattern, kind in MODIFICATION_TYPES:
+            if pattern.search(sentence):
+                modifications.append(
+                    {
+                        "modificationType": kind,
+                        "modificationDate": deed_date,
+                        "modificationDetails": sentence,
+                    }
+                )
+                break
+        if modifications:
+            break
+    return modifications
+
+
+def parse_dissolution(text, dates):
+    match = DISSOLVED_RE.search(text)
+    if not match:
+        return None
+    # the date of the dissolution follows its keyword
+    dissolution_dates = [
+        date
+        for position, date in dates
+        if match.start() <= position <= match.end() + DISSOLUTION_DATE_WINDOW
+    ]
+    dissolution = {
+        "dissolutionDate": dissolution_dates[0] if dissolution_dates else None
+    }
+    liquidation = LIQUIDATION_RE.search(text, match.start())
+    if liquidation:
+        dissolution["liquidationProcedure"] = sentence_at(text, liquidation.start())
+    return dissolution
+
+
+class RuleProcessor(BaseProcessor):
+    """Deterministic extractor for extracts that follow the notarial template.
+
+    Returns the canonical entity of `section`'s schema and falls back to
+    `fallback` (one of the OpenAI functions) when a field required by the
+    section's function schema is missing or the confidence of the regex
+    extraction is below `min_confidence`.
+    """
+
+    def __init__(
+        self, data, section, fallback=None, min_confidence=MIN_RULE_CONFIDENCE
+    ):
+        super().__init__(data)
+        self.section = section
+        self.schema = SCHEMAS[section]
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+
+    def arguments(self):
+        """Regex extraction, shaped like the arguments of the section's function."""
+        text = self.data
+
+        notary = NOTARY_RE.search(text)
+        name = COMPANY_NAME_RE.search(text)
+        company_rut = name and COMPANY_RUT_RE.match(text, name.end())
+        capital = CAPITAL_RE.search(text)
+        repertorio = REPERTORIO_RE.search(text)
+        dates = parse_dates(text)
+        deed_date = dates[0][1] if dates else None
+
+        company = {
+            "name": name.group(1).strip() if name else None,
+            "taxId": company_rut.group(1).upper() if company_rut else None,
+            "capital": parse_amount(capital.group(1)) if capital else None,
+            "registryDetails": repertorio.group(1) if repertorio else None,
+        }
+        arguments = {
+            "notary": notary.group(1).strip() if notary else None,
+            "deedDate": deed_date,
+            "company": {key: value for key, value in company.items() if value},
+            "parties": parse_parties(text, company["taxId"]),
+        }
+        if self.section == "MODIFICACIÓN":
+            arguments["modifications"] = parse_modifications(text, deed_date)
+        elif self.section == "DISOLUCIÓN":
+            arguments["dissolution"] = parse_dissolution(text, dates)
+        return arguments
+
+    def extract(self):
+        arguments = self.arguments()
+        found = {
+            "notary": arguments["notary"],
+            "deedDate": arguments["deedDate"],
+            "parties": arguments["parties"],
+            "modifications": arguments.get("modifications"),
+            "dissolution": (arguments.get("dissolution") or {}).get(
+                "dissolutionDate"
+            ),
+            **arguments["company"],
+        }
+        confidence = sum(
+            weight
+            for field, weight in SECTION_FIELD_WEIGHTS[self.section].items()
+            if found.get(field)
+        )
+        if not self.schema.is_complete(arguments):
+            # missing something the LLM would be forced to return, never
+            # good enough whatever the score
+            confidence = 0
+        return self.schema.parse(arguments), round(confidence, 2)
+
+    def process(self):
+        entities, confidence = self.extract()
+        if confidence < self.min_confidence and self.fallback is not None:
+            return self.fallback(self.data)
+        return entities
+
+
+class RuleFastPath:
+    """Callable wrapping an OpenAI extraction function so it is only called on
+    low confidence. A class instead of a closure so it can be pickled into
+    pool workers."""
+
+    def __init__(self, function, section, min_confidence=MIN_RULE_CONFIDENCE):
+        self.function = function
+        self.section = section
+        self.min_confidence = min_confidence
+
+    def __call__(self, pdf_text):
+        return RuleProcessor(
+            pdf_text,
+            self.section,
+            fallback=self.function,
+            min_confidence=self.min_confidence,
+        ).process()
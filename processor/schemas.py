@@ -0,0 +1,364 @@
+import json
+from utils.helpers import parse_json, parse_amount
+
+
+# Shared building blocks, every function schema uses the same field names so
+# the arguments of all three map to the same canonical entity.
+PARTY = {
+    "type": "object",
+    "properties": {
+        "entityType": {
+            "type": "string",
+            "enum": ["Individual", "ExistingCompany"],
+            "description": "Type of the party, can be an individual or an existing company",
+        },
+        "name": {
+            "type": "string",
+            "description": "the name of the individual or existing company",
+        },
+        "taxId": {
+            "type": "string",
+            "description": "the RUN, RUT, CI or tax ID of the individual or existing company",
+        },
+        "ownership": {
+            "type": "string",
+            "description": "Number of stocks or percentage of capital owned by individual or company",
+        },
+        "address": {
+            "type": "string",
+            "description": "the personal address of the individual or existing company",
+        },
+        "representative": {
+            "type": "string",
+            "description": "if the party is an existing company, name of the representative",
+        },
+    },
+    "required": ["name"],
+}
+
+COMPANY_PROPERTIES = {
+    "name": {"type": "string"},
+    "taxId": {"type": "string", "description": "the RUT of the company"},
+    "capital": {"type": "number"},
+    "registryDetails": {"type": "string"},
+    "businessPurpose": {
+        "type": "string",
+        "description": "Summary of the business purpose of the company in less than 10 words",
+    },
+}
+
+DEED_DATE = {
+    "type": "string",
+    "format": "date",
+    "description": "the date of the public deed",
+}
+
+
+def _parties(description):
+    return {"type": "array", "description": description, "items": PARTY}
+
+
+INCORPORATION_FUNCTION = {
+    "name": "get_incorporation_entities",
+    "description": "Identify the main entities, participants and events in a company incorporation legal text",
+    "parameters": {
+        "title": "Legal Document",
+        "type": "object",
+        "properties": {
+            "notary": {"type": "string"},
+            "deedDate": DEED_DATE,
+            "parties": _parties(
+                "The persons or companies that are incorporating a new company"
+            ),
+            "company": {
+                "type": "object",
+                "properties": COMPANY_PROPERTIES,
+                "required": ["name", "capital", "registryDetails"],
+            },
+        },
+        "required": ["parties", "company"],
+    },
+}
+
+MODIFICATION_FUNCTION = {
+    "name": "get_modification_entities",
+    "description": "Get the main participants in a legal text",
+    "parameters": {
+        "title": "Legal Document",
+        "type": "object",
+        "properties": {
+            "notary": {"type": "string"},
+            "deedDate": DEED_DATE,
+            "modifications": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "modificationType": {"type": "string"},
+                        "modificationDate": {"type": "string", "format": "date"},
+                        "modificationDetails": {"type": "string"},
+                    },
+                    "required": [
+                        "modificationType",
+                        "modificationDate",
+                        "modificationDetails",
+                    ],
+                },
+            },
+            "company": {
+                "type": "object",
+                "properties": COMPANY_PROPERTIES,
+                "required": ["name", "registryDetails"],
+            },
+            "parties": _parties(
+                "The persons or companies that are modifying an existing company"
+            ),
+        },
+        "required": ["modifications", "company", "parties"],
+    },
+}
+
+DISSOLUTION_FUNCTION = {
+    "name": "get_dissolution_entities",
+    "description": "Identify the main entities, participants and events in a company dissolution legal text",
+    "parameters": {
+        "title": "Legal Document",
+        "type": "object",
+        "properties": {
+            "notary": {"type": "string"},
+            "deedDate": DEED_DATE,
+            "parties": _parties("The persons or companies that are ending a company"),
+            "company": {
+                "type": "object",
+                "properties": {
+                    **COMPANY_PROPERTIES,
+                    "endBalanceDate": {
+                        "type": "string",
+                        "description": "the date of the end balance of the company",
+                    },
+                },
+                "required": ["name", "registryDetails"],
+            },
+            "dissolution": {
+                "type": "object",
+                "properties": {
+                    "dissolutionDate": {
+                        "type": "string",
+                        "description": "the date of the dissolution of the company",
+                    },
+                    "liquidationProcedure": {
+                        "type": "string",
+                        "description": "details on how the liquidation of the company will be handled",
+                    },
+                    "capitalDetails": {
+                        "type": "string",
+                        "description": "details about the capital of the company at the time of dissolution",
+                    },
+                },
+                "required": ["dissolutionDate"],
+            },
+        },
+        "required": ["parties", "company", "dissolution"],
+    },
+}
+
+# Canonical entity every extraction (LLM or rule based) is converted to
+CANONICAL_ENTITY = {
+    "type": "object",
+    "properties": {
+        "documentType": {
+            "type": "string",
+            "enum": ["incorporation", "modification", "dissolution"],
+        },
+        "notary": {"type": ["string", "null"]},
+        "deedDate": {"type": ["string", "null"]},
+        "company": {
+            "type": "object",
+            "properties": {
+                **COMPANY_PROPERTIES,
+                "capital": {"type": ["number", "null"]},
+                "endBalanceDate": {"type": "string"},
+            },
+        },
+        "parties": {"type": "array", "items": PARTY},
+        "modifications": MODIFICATION_FUNCTION["parameters"]["properties"][
+            "modifications"
+        ],
+        "dissolution": {
+            "type": ["object", "null"],
+            "properties": DISSOLUTION_FUNCTION["parameters"]["properties"][
+                "dissolution"
+            ]["properties"],
+        },
+    },
+    "required": ["documentType", "company", "parties"],
+}
+
+# Field names used by the previous versions of the schemas
+PARTY_ALIASES = {
+    "EntityType": "entityType",
+    "party_type": "entityType",
+    "EntityName": "name",
+    "TaxIdentifier": "taxId",
+    "RUN": "taxId",
+    "RUT": "taxId",
+    "OwnershipDetails": "ownership",
+    "property_of_company": "ownership",
+    "EntityAddress": "address",
+    "CompanyRepresentative": "representative",
+    "represented_by": "representative",
+}
+COMPANY_ALIASES = {
+    "RUT": "taxId",
+    "MainbusinessPurpose": "businessPurpose",
+    "businessPurposeSummary": "businessPurpose",
+}
+ENTITY_ALIASES = {
+    "companyModifications": "modifications",
+    "dissolutionDetails": "dissolution",
+}
+ENTITY_TYPES = {"person": "Individual", "company": "ExistingCompany"}
+
+_JSON_TYPES = {
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+    "null": type(None),
+}
+
+
+def compile_validator(schema):
+    """Compile a JSON schema (the subset used by the function schemas) into a
+    function returning the list of errors of a value."""
+    types = schema.get("type")
+    if isinstance(types, str):
+        types = [types]
+    python_types = tuple(
+        python_type
+        for json_type in types or ()
+        for python_type in (
+            _JSON_TYPES[json_type]
+            if isinstance(_JSON_TYPES[json_type], tuple)
+            else (_JSON_TYPES[json_type],)
+        )
+    )
+    accepts_bool = types is not None and "boolean" in types
+    enum = schema.get("enum")
+    required = schema.get("required", [])
+    properties = {
+        name: compile_validator(subschema)
+        for name, subschema in schema.get("properties", {}).items()
+    }
+    items = compile_validator(schema["items"]) if "items" in schema else None
+
+    def validate(value, path="$"):
+        if python_types and (
+            not isinstance(value, python_types)
+            or (isinstance(value, bool) and not accepts_bool)
+        ):
+            return [f"{path}: expected {'|'.join(types)}"]
+        errors = []
+        if enum is not None and value not in enum:
+            errors.append(f"{path}: {value!r} not in {enum}")
+        if isinstance(value, dict):
+            for name in required:
+                if value.get(name) is None:
+                    errors.append(f"{path}.{name}: required")
+            for name, validator in properties.items():
+                if value.get(name) is not None:
+                    errors.extend(validator(value[name], f"{path}.{name}"))
+        if items is not None and isinstance(value, list):
+            for index, item in enumerate(value):
+                errors.extend(items(item, f"{path}[{index}]"))
+        return errors
+
+    return validate
+
+
+validate_entity = compile_validator(CANONICAL_ENTITY)
+
+
+def _rename(data, aliases):
+    if not isinstance(data, dict):
+        return {}
+    return {aliases.get(key, key): value for key, value in data.items()}
+
+
+def load_arguments(arguments):
+    """Parse the `arguments` string of a function call, repairing it if needed."""
+    if isinstance(arguments, dict):
+        return arguments
+    try:
+        return json.loads(arguments)
+    except json.JSONDecodeError:
+        return json.loads(parse_json(arguments))
+
+
+def canonical_entity(document_type, arguments):
+    data = _rename(load_arguments(arguments), ENTITY_ALIASES)
+
+    company = _rename(data.get("company"), COMPANY_ALIASES)
+    if isinstance(company.get("capital"), str):
+        try:
+            company["capital"] = parse_amount(company["capital"])
+        except ValueError:
+            company["capital"] = None
+
+    parties = []
+    for party in data.get("parties") or []:
+        party = _rename(party, PARTY_ALIASES)
+        if party.get("entityType") in ENTITY_TYPES:
+            party["entityType"] = ENTITY_TYPES[party["entityType"]]
+        parties.append(party)
+
+    entity = {
+        "documentType": document_type,
+        "notary": data.get("notary"),
+        "deedDate": data.get("deedDate"),
+        "company": company,
+        "parties": parties,
+        "modifications": data.get("modifications") or [],
+        "dissolution": data.get("dissolution"),
+    }
+    errors = validate_entity(entity)
+    if errors:
+        entity["validationErrors"] = errors
+    return entity
+
+
+class ExtractionSchema:
+    def __init__(self, document_type, function):
+        self.document_type = document_type
+        self.function = function
+        self.validate_arguments = compile_validator(function["parameters"])
+
+    @property
+    def name(self):
+        return self.function["name"]
+
+    def parse(self, arguments):
+        entity = canonical_entity(self.document_type, arguments)
+        # the canonical model is loose, check what this function requires
+        errors = entity.get("validationErrors", []) + self.validate_arguments(entity)
+        if errors:
+            entity["validationErrors"] = list(dict.fromkeys(errors))
+        return entity
+
+    def is_complete(self, arguments):
+        """Whether `arguments` has every field the function requires, the
+        required arrays (parties, modifications) being non empty."""
+        required = self.function["parameters"]["required"]
+        return all(arguments.get(name) for name in required) and not (
+            self.validate_arguments(arguments)
+        )
+
+
+# Built once at import, keyed by section of "Empresas y Cooperativas"
+SCHEMAS = {
+    "CONSTITUCIÓN": ExtractionSchema("incorporation", INCORPORATION_FUNCTION),
+    "MODIFICACIÓN": ExtractionSchema("modification", MODIFICATION_FUNCTION),
+    "DISOLUCIÓN": ExtractionSchema("dissolution", DISSOLUTION_FUNCTION),
+}
@@ -0,0 +1,57 @@
+from database.dead_letter import DeadLetterStore
+from main import functions, get_engine, process_item
+from processor.openai_processor import openai_setup
+import argparse
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from utils.helpers import trimmed_text
+
+
+# Seconds between two passes over the due dead letters
+RETRY_INTERVAL = 300
+
+
+def retry_extraction(engine, payload):
+    from database.db_operations import upload_to_db
+
+    record = payload["record"]
+    record["entities"] = functions[record["section"]](trimmed_text(record))
+    upload_to_db(engine, record, payload["batch_id"])
+
+
+def get_handlers(engine):
+    from database.db_operations import upload_to_db
+
+    return {
+        "pdf": lambda payload: process_item(engine=engine, **payload),
+        "llm": lambda payload: retry_extraction(engine, payload),
+        "db": lambda payload: upload_to_db(
+            engine, payload["record"], payload["batch_id"]
+        ),
+    }
+
+
+def main(interval=RETRY_INTERVAL, once=False):
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()  # take environment variables from .env.
+    openai_setup(secrets=os.getenv("API_KEY"))
+
+    store = DeadLetterStore()
+    store.create_tables()
+    handlers = get_handlers(get_engine())
+    while True:
+        resolved, failed = store.retry_due(handlers)
+        logging.info(f"Dead letters retried: {resolved} resolved, {failed} failed")
+        if once:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retry failed documents")
+    parser.add_argument("--interval", type=int, default=RETRY_INTERVAL)
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+    main(args.interval, args.once)
@@ -1,15 +1,29 @@
 from bs4 import BeautifulSoup
+import os
 import requests
 from utils.helpers import retry_on_request
 
 
+_session = None
+_session_pid = None
+
+
+def get_session():
+    # one keep-alive session per process, never shared with forked workers
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        _session_pid = os.getpid()
+    return _session
+
+
 class BaseScraper:
     def __init__(self):
         pass
 
     @retry_on_request
-    def fetch_url(self, url):
-        response = requests.get(url)
+    def fetch_url(self, url, headers=None):
+        response = get_session().get(url, headers=headers)
         response.raise_for_status()  # Ensure we got a successful response
         return response
 
@@ -1,18 +1,34 @@
-from .base_scraper import BaseScraper
-from datetime import datetime
-from utils.helpers import retry_on_request
+from .base_scraper import BaseScraper, get_session
+from .index_cache import fetch_index
+from utils.helpers import local_now, retry_on_request
 from bs4 import BeautifulSoup
-import requests
+import logging
 
 
 class DiarioOficialScraper(BaseScraper):
     def __init__(self, date=None):
         super().__init__()
-        self.date = date if date else datetime.now().strftime("%d-%m-%Y")
+        self.date = date if date else local_now().strftime("%d-%m-%Y")
         self.url = f"https://www.diariooficial.interior.gob.cl/edicionelectronica/index.php?date={self.date}"
 
-    def fetch_editions(self):
-        response = self.fetch_url(self.url)
+    def fetch_editions(self, cache=None):
+        if cache is None:
+            return self.parse_editions(self.fetch_url(self.url))
+        # editions of past dates come from the cache, today's are revalidated
+        entry, _, html = fetch_index(
+            cache,
+            self.date,
+            "index",
+            self.url,
+            self.fetch_url,
+            lambda response: [
+                {"link": link} for link in self.parse_editions(response)
+            ],
+        )
+        cache.put(self.date, "index", entry, html)
+        return [record["link"] for record in entry["records"]]
+
+    def parse_editions(self, response):
         soup = self.parse_html(response)
 
         # Check if the page has a "No existen publicaciones" message
@@ -85,9 +101,38 @@ def soup_to_dictionary(soup):
     return soup_dictionary
 
 
+def iter_edition_items(contents, sections):
+    """Yield (section, sub_section, item) for the companies listed in `sections`."""
+    companies = contents.get("Sumario", {}).get("Empresas y Cooperativas")
+    if companies is None:
+        logging.info("Reached end of file")
+        return
+    for section in sections:
+        if section not in companies:
+            logging.info(f"No available content in section: {section}")
+            continue
+        # sections other than the three extracted ones may lack the "" title
+        for sub_section, items in companies[section].get("", {}).items():
+            for item in items:
+                yield section, sub_section, item
+
+
+def edition_records(contents):
+    """Flat list of the companies of an edition, with their section."""
+    companies = contents.get("Sumario", {}).get("Empresas y Cooperativas", {})
+    return [
+        {**item, "section": section, "sub_section": sub_section}
+        for section, sub_section, item in iter_edition_items(contents, companies)
+    ]
+
+
+def parse_edition_records(response):
+    return edition_records(soup_to_dictionary(parse_html(response)))
+
+
 @retry_on_request
-def fetch_url(url):
-    response = requests.get(url)
+def fetch_url(url, headers=None):
+    response = get_session().get(url, headers=headers)
     response.raise_for_status()  # Ensure we got a successful response
     return response
 
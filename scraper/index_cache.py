@@ -0,0 +1,107 @@
+from datetime import datetime
+import gzip
+import json
+import os
+import re
+import tempfile
+from utils.helpers import local_now
+
+
+class IndexCache:
+    """On-disk cache of the index pages of an edition, keyed by (date, page).
+
+    Each entry keeps the raw HTML, the records parsed from it and the
+    validators (ETag / Last-Modified) of the response. Pages of past dates
+    never change and are served from the cache without a request, today's
+    pages are revalidated with a conditional request and diffed against the
+    cached records so only new rows are returned.
+
+    With `refresh` the cached entries are ignored (and overwritten), every
+    page is fetched again and all its rows are returned, to reprocess dates
+    on purpose.
+    """
+
+    def __init__(self, root=None, refresh=False):
+        if root is None:
+            from settings import INDEX_CACHE_DIR
+
+            root = INDEX_CACHE_DIR
+        self.root = root
+        self.refresh = refresh
+
+    def _path(self, date, page):
+        page = re.sub(r"[^\w.-]+", "_", page)
+        return os.path.join(self.root, date, page)
+
+    def get(self, date, page):
+        if self.refresh:
+            return None
+        path = self._path(date, page)
+        try:
+            with open(f"{path}.json", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def get_html(self, date, page):
+        with gzip.open(f"{self._path(date, page)}.html.gz", "rb") as file:
+            return file.read()
+
+    def put(self, date, page, entry, html=None):
+        path = self._path(date, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if html is not None:
+            self._write(f"{path}.html.gz", gzip.compress(html))
+        self._write(
+            f"{path}.json", json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        )
+
+    def _write(self, path, data):
+        # write to a temporary file first so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+
+def is_historical(date):
+    today = local_now().date()
+    return datetime.strptime(date, "%d-%m-%Y").date() < today
+
+
+def fetch_index(cache, date, page, url, fetch, parse, key="link"):
+    """Fetch and parse an index page through the cache.
+
+    `fetch(url, headers)` returns the response, `parse(response)` its list of
+    records. Returns (entry, new_records, html): the entry to store once the
+    new records are processed, the records not seen in the cached entry and
+    the raw HTML to cache with it (None when the page did not change).
+    """
+    entry = cache.get(date, page)
+    if entry is not None and is_historical(date) and entry.get("complete"):
+        return entry, [], None
+
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    response = fetch(url, headers=headers)
+    if response.status_code == 304:
+        entry["complete"] = is_historical(date)
+        return entry, [], None
+
+    records = parse(response)
+    seen = {record[key] for record in entry["records"]} if entry else set()
+    new_records = [record for record in records if record[key] not in seen]
+    new_entry = {
+        "url": response.url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": datetime.now().isoformat(),
+        "records": records,
+        # a page fetched after its date is final
+        "complete": is_historical(date),
+    }
+    return new_entry, new_records, response.content
@@ -1,113 +1,162 @@
+from main import functions, get_engine, process_edition
+import argparse
 import json
-from database.db_connection import get_connection
-from database.db_operations import upload_to_db
-from scraper.base_scraper import BaseScraper
-from scraper.diario_oficial_scraper import (
-    DiarioOficialScraper,
-    soup_to_dictionary,
-    fetch_url,
-    parse_html,
-)
-from parser.pdf_parser import PdfParser
-from utils.helpers import clean_text, parse_json, get_dates_in_range, trim_text
-from processor.openai_processor import (
-    openai_setup,
-    get_incorporation_entities,
-    get_modification_entities,
-    function_disolucion,
-)
-import uuid
 import logging
-from json.decoder import JSONDecodeError
-from dotenv import load_dotenv
 import os
 import time
-import random
+import uuid
+from dotenv import load_dotenv
+from utils.helpers import local_now
 
 
 logging.basicConfig(level=logging.INFO)
 
 MIN_DELAY = 0.2
 MAX_DELAY = 1.1
+# Requests per second, same average pace as a random delay between the two
+RATE = 2 / (MIN_DELAY + MAX_DELAY)
+
+# Hours (Chilean time) in which editions (including extraordinarias) get published
+PUBLICATION_HOURS = range(6, 22)
+ACTIVE_POLL_SECONDS = 300
+IDLE_POLL_SECONDS = 3600
+# Poll sooner right after new rows showed up, more usually follow
+BURST_POLL_SECONDS = 60
+
+# Fields left out of the records pushed downstream
+HEAVY_FIELDS = ("text_content", "clean_text_content")
 
 load_dotenv()  # take environment variables from .env.
 
 
-def main():
-    # establish db connection
-    logging.info("Establishing server connection")
-    engine = get_connection(
-        user=os.getenv("AZURE_DB_USER"),
-        password=os.getenv("AZURE_DB_PASSWORD"),
-        host=os.getenv("AZURE_DB_HOST"),
-    )
+def poll_interval(
+    now, found_new, active=ACTIVE_POLL_SECONDS, idle=IDLE_POLL_SECONDS
+):
+    # The Diario Oficial appears Monday through Saturday
+    if now.weekday() == 6 or now.hour not in PUBLICATION_HOURS:
+        return idle
+    if found_new:
+        return min(BURST_POLL_SECONDS, active)
+    return active
 
-    # establish openai functions
-    functions = {
-        "CONSTITUCIÓN": get_incorporation_entities,
-        "MODIFICACIÓN": get_modification_entities,
-        "DISOLUCIÓN": function_disolucion,
+
+def publish(record):
+    """Push a newly ingested record downstream."""
+    summary = {
+        key: value for key, value in record.items() if key not in HEAVY_FIELDS
     }
-    # Unique batch id for this run
-    batch_id = str(uuid.uuid4())  # create DiarioOficialScraper instance
-    # Set date range (optional), Can be set to None, in which case it will default to only Today
+    logging.info(f"New record: {summary.get('company')} ({summary.get('link')})")
+    webhook_url = os.getenv("DOWNSTREAM_WEBHOOK_URL")
+    if webhook_url:
+        from scraper.base_scraper import get_session
+
+        try:
+            get_session().post(
+                webhook_url,
+                data=json.dumps(summary, ensure_ascii=False).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                timeout=10,
+            ).raise_for_status()
+        except Exception as e:
+            logging.error(f"Failed to push {summary.get('link')} downstream: {e}")
 
-    diario_oficial = (
-        DiarioOficialScraper()
+
+def scrape_date(date, engine, cache, batch_id, limiter=None, on_record=None):
+    from scraper.diario_oficial_scraper import DiarioOficialScraper
+
+    diario_oficial = DiarioOficialScraper(
+        date
     )  # can be initialized with optional date argument
     logging.info(f"Scraping for publication date: {diario_oficial.date}")
-    # call fetch_url
-    editions = (
-        diario_oficial.fetch_editions()
-    )  # can be 0, 1, 2 or more editions for a date
+    # can be 0, 1, 2 or more editions for a date
+    editions = diario_oficial.fetch_editions(cache)
     logging.info(f"Found {len(editions)} editions for {diario_oficial.date}")
-    # loop over each edition
+    new_records = 0
+
+    def count(record):
+        nonlocal new_records
+        new_records += 1
+        if on_record is not None:
+            on_record(record)
+
     for edition in editions:
-        # Convert the edition URL to point to the "empresas_cooperativas" section
-        url_parts = edition.split("?")
-        specific_url = f"https://www.diariooficial.interior.gob.cl/edicionelectronica/empresas_cooperativas.php?{url_parts[1]}"
-        # fetch url and parse html
-        response = fetch_url(specific_url)
-        soup = parse_html(response)
-        # extract content and save it as a dictionary
-        contents = soup_to_dictionary(soup)
-        # iterate over the companies and their pdfs
-        logging.info("Starting extraction...")
-        for section, function in functions.items():
-            if (
-                "Sumario" in contents
-                and "Empresas y Cooperativas" in contents["Sumario"]
-            ):
-                if section in contents["Sumario"]["Empresas y Cooperativas"]:
-                    for sub_section in contents["Sumario"]["Empresas y Cooperativas"][
-                        section
-                    ][""]:
-                        for item in contents["Sumario"]["Empresas y Cooperativas"][
-                            section
-                        ][""][sub_section]:
-                            pdf_link = item["link"]
-                            # get the text content of the pdf
-                            logging.info(f"Parsing PDF link: {pdf_link}")
-                            time.sleep(
-                                random.uniform(MIN_DELAY, MAX_DELAY)
-                            )  # Be nice to the government
-                            item["text_content"] = PdfParser().get_pdf_text(pdf_link)
-                            item["clean_text_content"] = clean_text(
-                                item["text_content"]
-                            )
-                            item["trimmed_text_content"] = trim_text(
-                                item["clean_text_content"]
-                            )
-                            item["section"] = section
-                            item["sub_section"] = sub_section
-                            item["publication_date"] = DiarioOficialScraper.date
-                            logging.info("Uploading record to database")
-                            upload_to_db(engine, item, batch_id)
-                else:
-                    logging.info(f"No available content in section: {section}")
-            else:
-                logging.info("Reached end of file")
+        process_edition(
+            edition,
+            functions,
+            diario_oficial.date,
+            engine,
+            batch_id,
+            limiter,
+            cache,
+            count,
+        )
+    return new_records
+
+
+def main(refresh=False):
+    from database.db_connection import create_tables
+    from database.dead_letter import DeadLetterStore
+    from database.task_queue import LocalRateLimiter
+    from scraper.index_cache import IndexCache
+
+    # Unique batch id for this run
+    batch_id = str(uuid.uuid4())
+    engine = get_engine()
+    create_tables(engine)
+    DeadLetterStore().create_tables()
+    scrape_date(
+        None, engine, IndexCache(refresh=refresh), batch_id, LocalRateLimiter(RATE)
+    )
+
+
+def daemon(active=ACTIVE_POLL_SECONDS, idle=IDLE_POLL_SECONDS):
+    from database.db_connection import create_tables
+    from database.dead_letter import DeadLetterStore
+    from database.task_queue import LocalRateLimiter
+    from scraper.index_cache import IndexCache
+
+    # resources are created once and kept warm between polls
+    engine = get_engine()
+    create_tables(engine)
+    DeadLetterStore().create_tables()
+    cache = IndexCache()
+    limiter = LocalRateLimiter(RATE)
+    batch_id = str(uuid.uuid4())
+
+    def poll(date):
+        try:
+            return scrape_date(date, engine, cache, batch_id, limiter, publish)
+        except Exception:
+            logging.exception(f"Polling {date} failed")
+            return 0
+
+    last_date = None
+    while True:
+        today = local_now().strftime("%d-%m-%Y")
+        if last_date is not None and last_date != today:
+            # a last look at yesterday for editions published late at night
+            poll(last_date)
+        last_date = today
+        found = poll(today)
+        interval = poll_interval(local_now(), found, active, idle)
+        logging.info(f"{found} new records, next poll in {interval} seconds")
+        time.sleep(interval)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Scrape today's Diario Oficial")
+    parser.add_argument(
+        "--daemon", action="store_true", help="keep polling for new editions"
+    )
+    parser.add_argument("--interval", type=int, default=ACTIVE_POLL_SECONDS)
+    parser.add_argument("--idle-interval", type=int, default=IDLE_POLL_SECONDS)
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignore the index cache and process every row of today again",
+    )
+    args = parser.parse_args()
+    if args.daemon:
+        daemon(args.interval, args.idle_interval)
+    else:
+        main(args.refresh)
@@ -0,0 +1,7 @@
+import os
+
+# Text extraction library for the PDFs: pypdf2, pdfminer or pypdfium2
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pypdf2")
+
+# Cached index pages of the editions, see scraper/index_cache.py
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", ".cache/index")
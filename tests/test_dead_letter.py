@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from database.dead_letter import DeadLetterStore, retry_delay
+
+
+class FakeDatetime(datetime):
+    now_value = datetime(2024, 1, 1)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now_value
+
+
+class DeadLetterStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = DeadLetterStore(
+            f"sqlite:///{os.path.join(directory.name, 'dead_letters.db')}",
+            max_retries=2,
+        )
+        self.addCleanup(self.store.engine.dispose)
+        self.store.create_tables()
+        patcher = mock.patch("database.dead_letter.datetime", FakeDatetime)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeDatetime.now_value = datetime(2024, 1, 1)
+
+    def advance(self, delta):
+        FakeDatetime.now_value += delta
+
+    def test_added_letter_is_due_after_the_first_delay(self):
+        self.assertTrue(
+            self.store.add("pdf", "link", {"item": 1}, ConnectionError("reset"))
+        )
+        self.assertEqual(self.store.due(), [])
+        self.advance(retry_delay(0))
+        [letter] = self.store.due()
+        self.assertEqual(letter.kind, "pdf")
+        self.assertEqual(letter.payload, {"item": 1})
+        self.assertEqual(letter.error_class, "ConnectionError")
+        self.assertEqual(letter.attempts, 1)
+
+    def test_add_logs_instead_of_raising(self):
+        store = DeadLetterStore("sqlite:///:memory:")  # no table
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(store.add("pdf", "link", {}, ValueError("x")))
+
+    def test_reschedule_backs_off_then_abandons(self):
+        self.store.add("db", "link", {}, ValueError("first"))
+        self.advance(retry_delay(0))
+        [letter] = self.store.due()
+        self.store.reschedule(letter, ValueError("second"))
+        self.advance(retry_delay(0))
+        self.assertEqual(self.store.due(), [])
+        self.advance(retry_delay(1) - retry_delay(0))
+        [letter] = self.store.due()
+        self.assertEqual(letter.retries, 1)
+        self.assertEqual(letter.error_message, "second")
+        self.store.reschedule(letter, ValueError("third"))
+        self.advance(timedelta(days=7))
+        self.assertEqual(self.store.due(), [])
+
+    def test_retry_due_runs_the_handler_of_each_kind(self):
+        self.store.add("pdf", "ok", {"n": 1}, ValueError("x"))
+        self.store.add("db", "broken", {"n": 2}, ValueError("x"))
+        self.advance(retry_delay(0))
+        handled = []
+
+        def fail(payload):
+            raise ConnectionError("still down")
+
+        with mock.patch("builtins.print"):
+            resolved, failed = self.store.retry_due(
+                {"pdf": handled.append, "db": fail}
+            )
+        self.assertEqual((resolved, failed), (1, 1))
+        self.assertEqual(handled, [{"n": 1}])
+        # only the failed one comes back, after its next delay
+        self.advance(retry_delay(1))
+        self.assertEqual([letter.key for letter in self.store.due()], ["broken"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from scraper.diario_oficial_scraper import iter_edition_items
+from scraper.index_cache import IndexCache, fetch_index
+
+DATE = "02-01-2018"
+
+
+class FakeResponse:
+    def __init__(self, links, status_code=200, etag='"v1"'):
+        self.links = links
+        self.status_code = status_code
+        self.url = "https://example.com/index.php"
+        self.headers = {"ETag": etag} if etag else {}
+        self.content = "".join(links).encode()
+
+
+class FakeSite:
+    """fetch() for fetch_index, answers 304 when the ETag matches."""
+
+    def __init__(self, links, etag='"v1"'):
+        self.links = links
+        self.etag = etag
+        self.requests = []
+
+    def fetch(self, url, headers):
+        self.requests.append(headers)
+        if self.etag and headers.get("If-None-Match") == self.etag:
+            return FakeResponse([], status_code=304)
+        return FakeResponse(list(self.links), etag=self.etag)
+
+
+def parse(response):
+    return [{"link": link} for link in response.links]
+
+
+class FetchIndexTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.cache = IndexCache(self.root)
+        # DATE is "today" unless a test moves the clock
+        self.today = datetime(2018, 1, 2, 12)
+        patcher = mock.patch(
+            "scraper.index_cache.local_now", side_effect=lambda: self.today
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, site, cache=None):
+        cache = cache or self.cache
+        entry, new, html = fetch_index(cache, DATE, "page", "url", site.fetch, parse)
+        cache.put(DATE, "page", entry, html)
+        return entry, [record["link"] for record in new], html
+
+    def test_first_fetch_returns_every_row(self):
+        entry, new, html = self.fetch(FakeSite(["a", "b"]))
+        self.assertEqual(new, ["a", "b"])
+        self.assertEqual(entry["etag"], '"v1"')
+        self.assertFalse(entry["complete"])
+        self.assertEqual(self.cache.get_html(DATE, "page"), b"ab")
+
+    def test_only_new_rows_are_returned(self):
+        self.fetch(FakeSite(["a", "b"], etag=None))
+        entry, new, _ = self.fetch(FakeSite(["a", "b", "c"], etag=None))
+        self.assertEqual(new, ["c"])
+        self.assertEqual(len(entry["records"]), 3)
+
+    def test_not_modified_returns_no_rows(self):
+        site = FakeSite(["a", "b"])
+        self.fetch(site)
+        entry, new, html = self.fetch(site)
+        self.assertEqual(site.requests[-1], {"If-None-Match": '"v1"'})
+        self.assertEqual(new, [])
+        self.assertIsNone(html)
+        self.assertEqual(len(entry["records"]), 2)
+        # the cached html is kept
+        self.assertEqual(self.cache.get_html(DATE, "page"), b"ab")
+
+    def test_page_becomes_complete_once_its_date_is_past(self):
+        site = FakeSite(["a"])
+        self.fetch(site)
+        self.today = datetime(2018, 1, 3, 9)
+        entry, new, _ = self.fetch(site)  # a last revalidation, 304
+        self.assertTrue(entry["complete"])
+        self.assertEqual(len(site.requests), 2)
+        # complete past pages are served without a request
+        entry, new, _ = self.fetch(site)
+        self.assertEqual(new, [])
+        self.assertEqual(len(site.requests), 2)
+
+    def test_refresh_fetches_and_returns_every_row_again(self):
+        site = FakeSite(["a", "b"])
+        self.fetch(site)
+        self.today = datetime(2018, 1, 3, 9)
+        self.fetch(site)
+        entry, new, _ = self.fetch(site, IndexCache(self.root, refresh=True))
+        self.assertEqual(new, ["a", "b"])
+        self.assertEqual(site.requests[-1], {})
+        self.assertEqual(len(site.requests), 3)
+
+
+class IterEditionItemsTest(unittest.TestCase):
+    def test_section_without_items_is_skipped(self):
+        contents = {
+            "Sumario": {
+                "Empresas y Cooperativas": {
+                    "CONSTITUCIÓN": {"": {"SpA": [{"link": "a"}]}},
+                    "OTROS": {"Otro título": {}},
+                }
+            }
+        }
+        items = list(
+            iter_edition_items(contents, ["CONSTITUCIÓN", "OTROS", "DISOLUCIÓN"])
+        )
+        self.assertEqual(items, [("CONSTITUCIÓN", "SpA", {"link": "a"})])
+
+
+if __name__ == "__main__":
+    unittest.main()
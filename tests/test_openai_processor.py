@@ -0,0 +1,109 @@
+import json
+import unittest
+from unittest import mock
+
+import main
+from processor.openai_processor import LocalBatchClient, OpenaiProcessor
+
+ARGUMENTS = {
+    "notary": "Juan Pérez Soto",
+    "deedDate": "2018-03-12",
+    "parties": [{"name": "María González", "RUN": "12.345.678-9"}],
+    "company": {"name": "ANDES SpA", "capital": "$ 1.000.000", "registryDetails": "1"},
+}
+
+
+def function_response(arguments):
+    message = {"function_call": {"arguments": json.dumps(arguments)}}
+    return {"choices": [{"message": message}]}
+
+
+def record(id, text="EXTRACTO texto", section="CONSTITUCIÓN"):
+    return {
+        "id": id,
+        "link": f"https://example.com/{id}.pdf",
+        "section": section,
+        "clean_text_content": f"header {text}",
+        "trimmed_text_offset": 7,
+    }
+
+
+class OpenaiProcessorTest(unittest.TestCase):
+    def test_entities_are_joined_by_id(self):
+        caller = mock.Mock(return_value=function_response(ARGUMENTS))
+        records = [record(1), record(2, section="DISOLUCIÓN")]
+        OpenaiProcessor(records, LocalBatchClient(caller)).process()
+
+        # each record sends its trimmed text to its section's function
+        bodies = [call.kwargs for call in caller.call_args_list]
+        self.assertEqual(bodies[0]["messages"][0]["content"], "EXTRACTO texto")
+        self.assertEqual(bodies[1]["function_call"]["name"], "get_dissolution_entities")
+        entities = records[0]["entities"]
+        self.assertEqual(entities["company"]["capital"], 1000000)
+        self.assertEqual(entities["parties"][0]["taxId"], "12.345.678-9")
+        self.assertEqual(records[1]["entities"]["documentType"], "dissolution")
+
+    def test_failed_request_only_fails_its_record(self):
+        responses = [RuntimeError("rate limited"), function_response(ARGUMENTS)]
+        records = [record(1), record(2)]
+        client = LocalBatchClient(mock.Mock(side_effect=responses))
+        OpenaiProcessor(records, client).process()
+        self.assertEqual(records[0]["extraction_error"]["code"], "RuntimeError")
+        self.assertIn("entities", records[1])
+
+    def test_malformed_body_only_fails_its_record(self):
+        responses = [{"choices": []}, function_response(ARGUMENTS)]
+        records = [record(1), record(2)]
+        client = LocalBatchClient(mock.Mock(side_effect=responses))
+        OpenaiProcessor(records, client).process()
+        self.assertEqual(records[0]["extraction_error"]["code"], "InvalidArguments")
+        self.assertIn("entities", records[1])
+
+    def test_records_missing_from_a_failed_batch_get_an_error(self):
+        client = mock.Mock()
+        client.submit.return_value = "batch_1"
+        client.status.return_value = {
+            "id": "batch_1",
+            "status": "expired",
+            "errors": {"data": [{"code": "expired"}]},
+        }
+        client.results.return_value = []
+        records = [record(1)]
+        OpenaiProcessor(records, client, poll_interval=0).process()
+        error = records[0]["extraction_error"]
+        self.assertEqual(error["code"], "MissingResult")
+        self.assertEqual(error["errors"], {"data": [{"code": "expired"}]})
+
+
+class RunBatchTest(unittest.TestCase):
+    def test_stored_records_are_hydrated_extracted_and_saved(self):
+        stored = {
+            "text_hash": "abc",
+            "trimmed_text_offset": 7,
+            "section": "CONSTITUCIÓN",
+            "link": "https://example.com/1.pdf",
+        }
+        rows = [(1, stored), (2, {**stored, "text_hash": "missing"})]
+        texts = {"abc": "header EXTRACTO texto"}
+        caller = mock.Mock(return_value=function_response(ARGUMENTS))
+        with mock.patch(
+            "database.db_operations.load_unextracted_records", return_value=rows
+        ), mock.patch(
+            "database.db_operations.load_text", side_effect=lambda e, h: texts.get(h)
+        ), mock.patch(
+            "utils.helpers.count_tokens", return_value=1
+        ), mock.patch(
+            "database.db_operations.save_extractions"
+        ) as save:
+            sent = main.run_batch(None, LocalBatchClient(caller))
+
+        self.assertEqual(sent, 1)
+        messages = caller.call_args.kwargs["messages"]
+        self.assertEqual(messages[0]["content"], "EXTRACTO texto")
+        saved = {record["id"]: record for record in save.call_args.args[1]}
+        self.assertEqual(saved[1]["entities"]["company"]["name"], "ANDES SpA")
+        self.assertEqual(saved[2]["extraction_error"]["code"], "MissingText")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from unittest import mock
+
+from processor.rule_processor import RuleFastPath, RuleProcessor
+
+INCORPORATION = (
+    "EXTRACTO Juan Carlos Pérez Soto, Notario Público, Santiago, certifica: "
+    "Por escritura pública de 12 de marzo de 2018, Repertorio N° 4.521-2018, "
+    "María José González Rojas, chilena, soltera, ingeniera, cédula de "
+    "identidad 12.345.678-9, y Pedro Andrés Muñoz Díaz, chileno, casado, "
+    "abogado, cédula de identidad N° 9.876.543-2, constituyeron una sociedad "
+    'por acciones denominada "INVERSIONES LOS ANDES SpA". Objeto: '
+    "inversiones. Capital: $ 1.000.000 dividido en 1.000 acciones."
+)
+DISSOLUTION = (
+    "EXTRACTO JUAN CARLOS PÉREZ SOTO, NOTARIO, certifica: Por escritura de 2 "
+    "de enero de 2020, Repertorio 77, Rosa Elena Díaz Mora, cédula de "
+    'identidad 8.888.888-8, única socia de la sociedad "SERVICIOS DÍAZ SpA", '
+    "RUT 77.111.222-3, acordó disolver la sociedad con fecha 31 de diciembre "
+    "de 2019. La liquidación la practicará la misma socia."
+)
+# a notary, an unattributed RUT and a capital, but no parties nor registry
+INCOMPLETE = "Juan Pérez Soto, Notario. 12.345.678-9. Capital $ 100.000."
+
+
+class RuleProcessorTest(unittest.TestCase):
+    def test_complete_incorporation_skips_the_fallback(self):
+        fallback = mock.Mock()
+        entities = RuleProcessor(INCORPORATION, "CONSTITUCIÓN", fallback).process()
+        fallback.assert_not_called()
+        self.assertEqual(entities["notary"], "Juan Carlos Pérez Soto")
+        self.assertEqual(entities["deedDate"], "2018-03-12")
+        self.assertEqual(entities["company"]["name"], "INVERSIONES LOS ANDES SpA")
+        self.assertEqual(entities["company"]["capital"], 1000000)
+        self.assertEqual(entities["company"]["registryDetails"], "4.521-2018")
+        self.assertEqual(
+            [party["taxId"] for party in entities["parties"]],
+            ["12.345.678-9", "9.876.543-2"],
+        )
+        self.assertNotIn("validationErrors", entities)
+
+    def test_partner_run_is_not_the_company_rut(self):
+        entities, _ = RuleProcessor(INCORPORATION, "CONSTITUCIÓN").extract()
+        self.assertNotIn("taxId", entities["company"])
+
+    def test_complete_dissolution_skips_the_fallback(self):
+        fallback = mock.Mock()
+        entities = RuleProcessor(DISSOLUTION, "DISOLUCIÓN", fallback).process()
+        fallback.assert_not_called()
+        self.assertEqual(entities["notary"], "JUAN CARLOS PÉREZ SOTO")
+        self.assertEqual(entities["company"]["taxId"], "77.111.222-3")
+        self.assertEqual(entities["dissolution"]["dissolutionDate"], "2019-12-31")
+        self.assertEqual(
+            [party["taxId"] for party in entities["parties"]], ["8.888.888-8"]
+        )
+
+    def test_incomplete_extract_scores_zero_and_calls_the_fallback(self):
+        _, confidence = RuleProcessor(INCOMPLETE, "CONSTITUCIÓN").extract()
+        self.assertEqual(confidence, 0)
+        fallback = mock.Mock(return_value={"documentType": "incorporation"})
+        result = RuleProcessor(INCOMPLETE, "CONSTITUCIÓN", fallback).process()
+        fallback.assert_called_once_with(INCOMPLETE)
+        self.assertEqual(result, {"documentType": "incorporation"})
+
+    def test_modification_without_amendment_calls_the_fallback(self):
+        # the incorporation template has no modification in it
+        fallback = mock.Mock()
+        RuleProcessor(INCORPORATION, "MODIFICACIÓN", fallback).process()
+        fallback.assert_called_once()
+
+    def test_fast_path_wraps_the_function(self):
+        fallback = mock.Mock()
+        RuleFastPath(fallback, "CONSTITUCIÓN")(INCOMPLETE)
+        fallback.assert_called_once_with(INCOMPLETE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+
+from processor.schemas import (
+    SCHEMAS,
+    canonical_entity,
+    compile_validator,
+    load_arguments,
+)
+
+
+class CompileValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.validate = compile_validator(
+            {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "capital": {"type": ["number", "null"]},
+                    "kind": {"type": "string", "enum": ["a", "b"]},
+                    "items": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"id": {"type": "integer"}},
+                            "required": ["id"],
+                        },
+                    },
+                },
+                "required": ["name"],
+            }
+        )
+
+    def test_valid_value(self):
+        self.assertEqual(
+            self.validate({"name": "x", "capital": 1.5, "items": [{"id": 1}]}), []
+        )
+
+    def test_errors_have_their_path(self):
+        errors = self.validate(
+            {"capital": "100", "kind": "c", "items": [{"id": 1}, {}]}
+        )
+        self.assertEqual(
+            errors,
+            [
+                "$.name: required",
+                "$.capital: expected number|null",
+                "$.kind: 'c' not in ['a', 'b']",
+                "$.items[1].id: required",
+            ],
+        )
+
+    def test_bool_is_not_a_number(self):
+        self.assertEqual(
+            self.validate({"name": "x", "capital": True}),
+            ["$.capital: expected number|null"],
+        )
+
+    def test_wrong_type(self):
+        self.assertEqual(self.validate([]), ["$: expected object"])
+
+
+class LoadArgumentsTest(unittest.TestCase):
+    def test_valid_json(self):
+        self.assertEqual(load_arguments('{"a": [1, 2]}'), {"a": [1, 2]})
+
+    def test_repairs_quotes_trailing_commas_and_comments(self):
+        raw = "{'a': [1, 2,], // the parties\n 'b': {'c': 'd',},}"
+        self.assertEqual(load_arguments(raw), {"a": [1, 2], "b": {"c": "d"}})
+
+    def test_dicts_are_passed_through(self):
+        arguments = {"a": 1}
+        self.assertIs(load_arguments(arguments), arguments)
+
+
+class CanonicalEntityTest(unittest.TestCase):
+    def test_old_field_names_are_mapped(self):
+        entity = canonical_entity(
+            "modification",
+            {
+                "company": {
+                    "name": "ANDES SpA",
+                    "RUT": "76.543.210-K",
+                    "capital": "$ 5.000.000,50",
+                    "MainbusinessPurpose": "inversiones",
+                    "registryDetails": "1",
+                },
+                "parties": [
+                    {
+                        "EntityType": "person",
+                        "EntityName": "Luis Vera",
+                        "RUN": "10.111.222-3",
+                        "represented_by": "nadie",
+                    }
+                ],
+                "companyModifications": [
+                    {
+                        "modificationType": "aumento de capital",
+                        "modificationDate": "2019-06-05",
+                        "modificationDetails": "capital a $ 5.000.000",
+                    }
+                ],
+            },
+        )
+        self.assertEqual(
+            entity["company"],
+            {
+                "name": "ANDES SpA",
+                "taxId": "76.543.210-K",
+                "capital": 5000000.5,
+                "businessPurpose": "inversiones",
+                "registryDetails": "1",
+            },
+        )
+        self.assertEqual(
+            entity["parties"],
+            [
+                {
+                    "entityType": "Individual",
+                    "name": "Luis Vera",
+                    "taxId": "10.111.222-3",
+                    "representative": "nadie",
+                }
+            ],
+        )
+        self.assertEqual(len(entity["modifications"]), 1)
+        self.assertNotIn("validationErrors", entity)
+
+    def test_unparseable_capital_is_dropped(self):
+        entity = canonical_entity("incorporation", {"company": {"capital": "n/a"}})
+        self.assertIsNone(entity["company"]["capital"])
+
+
+class ExtractionSchemaTest(unittest.TestCase):
+    def test_parse_checks_the_function_schema(self):
+        entity = SCHEMAS["CONSTITUCIÓN"].parse(
+            '{"parties": [{"name": "María"}], '
+            '"company": {"name": "ANDES SpA", "capital": 1000}}'
+        )
+        self.assertEqual(
+            entity["validationErrors"], ["$.company.registryDetails: required"]
+        )
+
+    def test_dissolution_requires_its_details(self):
+        entity = SCHEMAS["DISOLUCIÓN"].parse(
+            {"parties": [], "company": {"name": "X", "registryDetails": "1"}}
+        )
+        self.assertEqual(entity["validationErrors"], ["$.dissolution: required"])
+
+    def test_complete_arguments_have_no_errors(self):
+        entity = SCHEMAS["CONSTITUCIÓN"].parse(
+            {
+                "parties": [{"name": "María"}],
+                "company": {
+                    "name": "ANDES SpA",
+                    "capital": 1000,
+                    "registryDetails": "1",
+                },
+            }
+        )
+        self.assertNotIn("validationErrors", entity)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import time
+import unittest
+from unittest import mock
+
+from database.task_queue import (
+    LeaseHeartbeat,
+    LeaseLost,
+    LocalRateLimiter,
+    LocalTaskQueue,
+)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+
+
+class LocalTaskQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("database.task_queue.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = LocalTaskQueue(lease_seconds=10, max_attempts=2)
+        self.queue.enqueue("date", "01-01-2018", {"date": "01-01-2018"})
+
+    def test_enqueue_is_idempotent(self):
+        self.queue.enqueue("date", "01-01-2018", {"date": "01-01-2018"})
+        self.assertEqual(len(self.queue.tasks), 1)
+
+    def test_leased_task_is_not_leased_twice(self):
+        self.assertIsNotNone(self.queue.lease("a"))
+        self.assertIsNone(self.queue.lease("b"))
+
+    def test_expired_lease_is_taken_over(self):
+        task = self.queue.lease("a")
+        self.clock.now += 11
+        taken = self.queue.lease("b")
+        self.assertEqual(taken["id"], task["id"])
+        self.assertEqual(taken["attempts"], 2)
+        # the first worker no longer owns it
+        self.assertFalse(self.queue.heartbeat(task, "a"))
+        self.assertFalse(self.queue.complete(task, "a"))
+        self.assertTrue(self.queue.complete(taken, "b"))
+        self.assertEqual(self.queue.tasks[task["id"]]["status"], "done")
+
+    def test_heartbeat_extends_the_lease(self):
+        task = self.queue.lease("a")
+        self.clock.now += 8
+        self.assertTrue(self.queue.heartbeat(task, "a"))
+        self.clock.now += 8
+        self.assertIsNone(self.queue.lease("b"))
+
+    def test_expired_lease_on_last_attempt_fails(self):
+        self.queue.lease("a")
+        self.clock.now += 11
+        self.queue.lease("b")
+        self.clock.now += 11
+        self.assertIsNone(self.queue.lease("c"))
+        stored = self.queue.tasks[1]
+        self.assertEqual(stored["status"], "failed")
+        self.assertEqual(stored["last_error"], "lease expired")
+        self.assertIsNone(stored["leased_by"])
+
+    def test_release_retries_until_max_attempts(self):
+        task = self.queue.lease("a")
+        self.assertTrue(self.queue.release(task, "a", error="boom"))
+        self.assertEqual(self.queue.tasks[1]["status"], "pending")
+        task = self.queue.lease("a")
+        self.assertTrue(self.queue.release(task, "a", error="boom again"))
+        self.assertEqual(self.queue.tasks[1]["status"], "failed")
+        self.assertEqual(self.queue.tasks[1]["last_error"], "boom again")
+        self.assertIsNone(self.queue.lease("a"))
+
+
+class LeaseHeartbeatTest(unittest.TestCase):
+    def test_check_raises_once_the_lease_is_lost(self):
+        queue = LocalTaskQueue(lease_seconds=10)
+        queue.enqueue("date", "01-01-2018", {})
+        task = queue.lease("a")
+        queue.tasks[task["id"]]["leased_by"] = "b"
+        with LeaseHeartbeat(queue, task, "a", interval=0.01) as heartbeat:
+            self.assertTrue(heartbeat.lost.wait(1))
+            with self.assertRaises(LeaseLost):
+                heartbeat.check()
+
+    def test_check_passes_while_renewed(self):
+        queue = LocalTaskQueue(lease_seconds=10)
+        queue.enqueue("date", "01-01-2018", {})
+        task = queue.lease("a")
+        with LeaseHeartbeat(queue, task, "a", interval=0.01) as heartbeat:
+            time.sleep(0.05)
+            heartbeat.check()
+
+
+class LocalRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("database.task_queue.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reserves_consecutive_slots(self):
+        limiter = LocalRateLimiter(rate=4)
+        for _ in range(3):
+            limiter.acquire("site")
+        self.assertEqual(self.clock.slept, [0, 0.25, 0.5])
+
+    def test_sites_are_limited_separately(self):
+        limiter = LocalRateLimiter(rate=4)
+        limiter.acquire("a")
+        limiter.acquire("b")
+        self.assertEqual(self.clock.slept, [0, 0])
+
+    def test_free_slot_after_idle_time(self):
+        limiter = LocalRateLimiter(rate=4)
+        limiter.acquire("site")
+        self.clock.now += 1
+        limiter.acquire("site")
+        self.assertEqual(self.clock.slept, [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1 +1,5 @@
 MAX_TOKENS = 3800
+# Publication dates and hours of the Diario Oficial are in Chilean time
+TIMEZONE = "America/Santiago"
+# Minimum confidence for the rule based extractor to skip the LLM
+MIN_RULE_CONFIDENCE = 0.75
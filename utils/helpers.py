@@ -2,47 +2,76 @@ from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
-    retry_if_exception_type,
+    retry_if_exception,
+    wait_fixed,
 )
-import tiktoken
-from .constants import MAX_TOKENS
+from functools import lru_cache
+from .constants import MAX_TOKENS, TIMEZONE
 import re
-import openai.error
-import requests
-from sqlalchemy.exc import OperationalError
 from datetime import datetime, timedelta
-from requests.exceptions import ReadTimeout
-import psycopg2
+from zoneinfo import ZoneInfo
+
+
+@lru_cache(maxsize=None)
+def _retryable_exceptions():
+    # imported on the first failure, not when the decorator is applied
+    import openai.error
+    import psycopg2
+    import requests
+    from requests.exceptions import ReadTimeout
+    from sqlalchemy.exc import OperationalError
+
+    return (
+        openai.error.Timeout,
+        openai.error.APIError,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        requests.HTTPError,
+        OperationalError,
+        ConnectionError,
+        ConnectionResetError,
+        ReadTimeout,
+        psycopg2.OperationalError,
+        IOError,
+    )
+
+
+def is_retryable(exception):
+    return isinstance(exception, _retryable_exceptions())
 
 
 # Define a decorator for retrying failed requests
 retry_on_request = retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=5, max=15),
-    retry=retry_if_exception_type(
-        (
-            openai.error.Timeout,
-            openai.error.APIError,
-            openai.error.APIConnectionError,
-            openai.error.ServiceUnavailableError,
-            requests.HTTPError,
-            OperationalError,
-            ConnectionError,
-            ConnectionResetError,
-            ReadTimeout,
-            psycopg2.OperationalError,
-            IOError,
-        )
-    ),
+    retry=retry_if_exception(is_retryable),
+)
+
+# One quick retry for a dropped connection, for work that is dead lettered on
+# failure and retried later with backoff by retry_dead_letters.py
+retry_fast = retry(
+    stop=stop_after_attempt(2),
+    wait=wait_fixed(1),
+    retry=retry_if_exception(is_retryable),
 )
 
 
+@lru_cache(maxsize=None)
+def _encoding():
+    import tiktoken
+
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text))
+
+
 def clean_text(text):
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
     # Remove newline and extra spaces
     text = re.sub(r"\n", " ", text)
     text = re.sub(r"\s+", " ", text).strip()
-    if len(encoding.encode(text)) > MAX_TOKENS:
+    if count_tokens(text) > MAX_TOKENS:
         text = text[:MAX_TOKENS]  # naive way
 
     return text
@@ -62,12 +91,28 @@ def parse_json(raw_json):
     return fixed_json_string
 
 
-def get_dates_in_range(from_date, to_date):
+def parse_amount(amount):
+    # Chilean format: dots as thousands separator, comma for decimals
+    amount = re.sub(r"[^\d,\.]", "", str(amount))
+    integer, _, decimals = amount.partition(",")
+    integer = integer.replace(".", "")
+    if not integer:
+        raise ValueError(f"Not an amount: {amount!r}")
+    return float(f"{integer}.{decimals}") if decimals else int(integer)
+
+
+def local_now():
+    """Current time in Chile, whatever the timezone of the host."""
+    return datetime.now(ZoneInfo(TIMEZONE))
+
+
+def iter_dates_in_range(from_date, to_date):
+    """Lazily yield the dates between from_date and to_date (inclusive)."""
     if from_date is None or to_date is None:
-        return None
+        return iter([None])
     from_date = datetime.strptime(from_date, "%d-%m-%Y")
     to_date = datetime.strptime(to_date, "%d-%m-%Y")
-    today = datetime.now()
+    today = local_now().replace(tzinfo=None)
     # Check if to_date is greater than from_date
     if to_date < from_date:
         raise ValueError(
@@ -77,23 +122,39 @@ def get_dates_in_range(from_date, to_date):
     if to_date > today:
         raise ValueError("Error: 'to_date' cannot be in the future.")
     delta = to_date - from_date
-    date_list = [
+    return (
         (from_date + timedelta(days=i)).strftime("%d-%m-%Y")
         for i in range(delta.days + 1)
-    ]
-    return date_list
+    )
 
 
-def trim_text(text, search_word="EXTRACTO", search_range=800):
-    """Function printing python version."""
+def get_dates_in_range(from_date, to_date):
+    if from_date is None or to_date is None:
+        return None
+    return list(iter_dates_in_range(from_date, to_date))
 
-    search_text = text[:search_range]
 
-    try:
-        start = search_text.index(search_word)
-        return text[start:]
-    except ValueError:
+def trim_offset(text, search_word="EXTRACTO", search_range=800):
+    """Offset where the extract starts, None if search_word is not found."""
+    start = text.find(search_word, 0, search_range)
+    if start == -1:
         print(
             f"'{search_word}' not found in the first {search_range} characters of the text."
         )
-        return text
+        return None
+    return start
+
+
+def trim_text(text, search_word="EXTRACTO", search_range=800):
+    return text[trim_offset(text, search_word, search_range) or 0 :]
+
+
+def trimmed_text(record):
+    """Trimmed text of a record, stored either as a copy or as an offset.
+
+    A None offset means the extract start was not found, the trimmed text is
+    then the whole clean text, as trim_text returns it.
+    """
+    if "trimmed_text_content" in record:
+        return record["trimmed_text_content"]
+    return record["clean_text_content"][record.get("trimmed_text_offset") or 0 :]